@@ -8,15 +8,24 @@ This module handles all database operations for the ChatGPT Explorer.
 # Below, we'll set up the database manager class.
 
 # General imports
+import hashlib
+import io
 import logging
+import os
+import threading
 from pathlib import Path
-import json
 from importlib import import_module
 from functools import lru_cache
-from typing import List
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Third-party imports
+import numpy as np
+import orjson
 
 # Project imports
-from models import ClusteringResults, Conversation
+from models import ClusterMetrics, ClusteringResults, Conversation
 
 # Set up the logger
 logger = logging.getLogger(__name__)
@@ -28,6 +37,50 @@ def get_sqlite3():
     return import_module("sqlite3")
 
 
+# The most bound parameters a single statement can have on older SQLite builds; this bounds
+# the number of rows that bulk_insert packs into each INSERT statement
+SQLITE_MAX_VARIABLES = 999
+
+# How many conversation rows are serialized at a time when streaming them to the client
+CONVERSATION_STREAM_BATCH_SIZE = 2_000
+
+# Per-connection PRAGMAs; the WAL journal mode itself is persisted in the database file
+CONNECTION_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -65_536,  # Negative values are in KiB, so this is a 64MB page cache
+    "mmap_size": 268_435_456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5_000,
+}
+
+
+# ======================
+# EMBEDDING QUANTIZATION
+# ======================
+# Embeddings are stored as int8 vectors with a float32 scale per vector, which is 4x smaller
+# than float32 (a row is recovered as its int8 values times its scale). The OpenAI embeddings are
+# L2-normalized, so this is close to lossless for the cosine / euclidean comparisons that the
+# clustering relies on.
+
+
+def quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize a matrix of embeddings to int8, with a separate scale for each row.
+
+    Args:
+        embeddings (np.ndarray): A 2D array of embeddings, one per row
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The (n_rows, n_dimensions) int8 array of quantized
+        embeddings, and the (n_rows, 1) float32 array of per-row scales
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.max(np.abs(embeddings), axis=1, keepdims=True) / 127
+    scales[scales == 0] = 1
+    quantized = np.round(embeddings / scales).astype(np.int8)
+    return quantized, scales
+
+
 # ===================
 # DATABASE MANAGEMENT
 # ===================
@@ -37,13 +90,178 @@ def get_sqlite3():
 class DatabaseManager:
     def __init__(self, db_path: str):
         self.db_path = Path(db_path)
-        logger.info(f"Initialized DatabaseManager with database path: {db_path}")
+        self._write_conn = None
+        self._local = threading.local()
+        self._read_conns = (
+            []
+        )  # Every thread's read connection, so close() can close them all
+
+        # Processed data is only ever added (and a committed cluster solution is never modified),
+        # so once we've seen it, it can be cached for the lifetime of the process
+        self._has_data_cached = False
+        self._clusters_in_solution_cache = {}
+        self._clusters_in_solution_json_cache = {}
+
+        # Results that change whenever processed data is added are cached along with the
+        # database's data signature (see _data_signature), and re-queried once it changes
+        self._no_data_signature = None
+        self._cluster_solutions_cache = None  # (data signature, solutions)
+        self._cluster_solutions_json_cache = None  # (solutions, solutions JSON, ETag)
+
+        # Embeddings live in .npy sidecars next to the database, as one contiguous int8 matrix
+        # each (see quantize_embeddings); the tables only store the row offset of each vector
+        self.conversation_embeddings_path = self.db_path.with_name(
+            f"{self.db_path.stem}_embeddings.npy"
+        )
+        self.centroid_embeddings_path = self.db_path.with_name(
+            f"{self.db_path.stem}_centroid_embeddings.npy"
+        )
+
+        # Switch the database to WAL mode, so that readers don't block the writer (and vice versa)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        logger.info("Initialized DatabaseManager with database path: %s", db_path)
+
+    def _connect(self, **connect_kwargs):
+        """Open a new connection to the database with the tuning PRAGMAs applied"""
+        sqlite3 = get_sqlite3()
+        conn = sqlite3.connect(self.db_path, **connect_kwargs)
+        for pragma, value in CONNECTION_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+        return conn
+
+    @property
+    def read_conn(self):
+        """
+        Lazily open a long-lived read connection for the calling thread. The endpoints read from
+        the threadpool, so each worker thread reuses its own warm connection (and its cache of
+        prepared statements), rather than opening a new one for every query.
+        """
+        conn = getattr(self._local, "read_conn", None)
+        if conn is None:
+            # The connection is only ever used by this thread, but close() is called from another
+            conn = self._connect(cached_statements=256, check_same_thread=False)
+            self._local.read_conn = conn
+            self._read_conns.append(conn)
+        return conn
+
+    @property
+    def write_conn(self):
+        """Lazily open the long-lived connection used for all writes"""
+        if self._write_conn is None:
+            # Transactions are managed explicitly (see write_transaction). Only the processing
+            # worker writes, from a single thread, using its own DatabaseManager; the API process
+            # never opens this connection (its endpoints only use read_conn)
+            self._write_conn = self._connect(isolation_level=None)
+        return self._write_conn
+
+    def close(self):
+        """Close the write connection and every thread's read connection"""
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+        while self._read_conns:
+            self._read_conns.pop().close()
+        self._local = threading.local()
+
+    @contextmanager
+    def write_transaction(self, deferred_index_tables: Sequence[str] = ()):
+        """
+        Run a block of writes inside a single transaction on the write connection.
+        BEGIN IMMEDIATE takes the write lock up front, rather than upgrading a read
+        lock mid-transaction (which is what leads to SQLITE_BUSY errors).
+
+        Args:
+            deferred_index_tables (Sequence[str]): Tables whose secondary indexes are dropped
+                for the duration of the block and rebuilt once before committing, rather than
+                being updated row by row during bulk writes. If the block fails, the rollback
+                restores them.
+        """
+        conn = self.write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        # The embedding sidecar files aren't part of the transaction, so any rows appended to
+        # them during the block are truncated away again if it's rolled back
+        sidecar_row_counts = self._sidecar_row_counts()
+        try:
+            deferred_index_definitions = self._drop_secondary_indexes(
+                conn, deferred_index_tables
+            )
+            yield conn
+            for index_sql in deferred_index_definitions:
+                conn.execute(index_sql)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self._truncate_sidecars(sidecar_row_counts)
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _drop_secondary_indexes(conn, tables: Sequence[str]) -> List[str]:
+        """Drop the secondary indexes on some tables, returning their CREATE INDEX statements"""
+        if not tables:
+            return []
+
+        # Indexes backing PRIMARY KEY / UNIQUE constraints have no SQL (and can't be dropped)
+        index_definitions = conn.execute(
+            f"""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL
+            AND tbl_name IN ({', '.join('?' * len(tables))})
+            """,
+            list(tables),
+        ).fetchall()
+        for index_name, _ in index_definitions:
+            conn.execute(f'DROP INDEX "{index_name}"')
+        return [index_sql for _, index_sql in index_definitions]
+
+    @contextmanager
+    def savepoint(self, name: str):
+        """
+        Run a block of writes inside a savepoint; this is meant to be nested within
+        write_transaction, so a failing stage is rolled back without losing the others.
+
+        Args:
+            name (str): The name of the savepoint
+        """
+        conn = self.write_conn
+        conn.execute(f"SAVEPOINT {name}")
+        sidecar_row_counts = self._sidecar_row_counts()
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            self._truncate_sidecars(sidecar_row_counts)
+            raise
+        conn.execute(f"RELEASE {name}")
+
+    @staticmethod
+    def bulk_insert(conn, table: str, columns: List[str], rows: Iterable[Sequence]):
+        """
+        Insert rows with multi-row INSERT ... VALUES (...), (...) statements, which is fewer
+        round trips into SQLite than executemany's one statement execution per row.
+
+        Args:
+            conn: The connection to insert the rows with
+            table (str): The table to insert the rows into
+            columns (List[str]): The columns that the values in each row correspond to
+            rows (Iterable[Sequence]): The rows to insert, each following the order of columns
+        """
+        rows_per_statement = max(SQLITE_MAX_VARIABLES // len(columns), 1)
+        row_placeholders = f"({', '.join('?' * len(columns))})"
+        statement_prefix = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+
+        rows = iter(rows)
+        while chunk := list(islice(rows, rows_per_statement)):
+            conn.execute(
+                statement_prefix + ", ".join([row_placeholders] * len(chunk)),
+                [value for row in chunk for value in row],
+            )
 
     def initialize_database(self):
         """Create database tables if they don't exist"""
         logger.info("Initializing database tables")
-        sqlite3 = get_sqlite3()
-        with sqlite3.connect(self.db_path) as conn:
+        with self.write_transaction() as conn:
             cursor = conn.cursor()
 
             # Create conversations table
@@ -59,7 +277,7 @@ class DatabaseManager:
                     messages_markdown TEXT, -- This is a Markdown string containing the entire conversation
                     summary TEXT, -- This is a summary of the conversation
                     tags TEXT, -- This is a JSON string containing a list of tags associated with the conversation
-                    embedding BLOB, -- This is a binary large object containing the conversation's embedding
+                    emb_row INTEGER, -- This is the row of the conversation's embedding in the embeddings sidecar file
                     umap_x REAL, -- This is the UMAP x-coordinate of the conversation's embedding
                     umap_y REAL -- This is the UMAP y-coordinate of the conversation's embedding
                 )
@@ -75,7 +293,7 @@ class DatabaseManager:
                     cluster_id TEXT,
                     conversation_ids TEXT, -- This is a JSON string containing a list of the conversation IDs that belong to this cluster
                     centroid_conversation_ids TEXT, -- This is a JSON string containing a list of the conversation IDs that are the centroids of this cluster
-                    centroid_embedding BLOB, -- This is a binary large object containing the centroid embedding of the cluster
+                    centroid_row INTEGER, -- This is the row of the cluster's centroid embedding in the centroid embeddings sidecar file
                     cluster_size INTEGER, -- The number of conversations in the cluster
                     cluster_label TEXT, -- The label of the cluster
                     cluster_description TEXT, -- A description of the cluster
@@ -89,8 +307,269 @@ class DatabaseManager:
                 )
                 """
             )
+
+            # Databases created before the embeddings moved into sidecar files are missing
+            # the row offset columns (their BLOB columns are simply left unused)
+            self._add_missing_column(cursor, "conversations", "emb_row", "INTEGER")
+            self._add_missing_column(cursor, "clusters", "centroid_row", "INTEGER")
         logger.info("Database tables initialized successfully")
 
+    @staticmethod
+    def _add_missing_column(cursor, table: str, column: str, column_type: str):
+        """Add a column to an existing table, if it doesn't have one with that name yet"""
+        existing_columns = {
+            row[1] for row in cursor.execute(f"PRAGMA table_info({table})")
+        }
+        if column not in existing_columns:
+            logger.info("Adding missing column %s to table %s", column, table)
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    @staticmethod
+    def _scales_path(path: Path) -> Path:
+        """Get the path of the per-row scales that go along with a quantized sidecar file"""
+        return path.with_name(f"{path.stem}_scales.npy")
+
+    def _sidecar_row_counts(self) -> Dict[Path, Optional[int]]:
+        """
+        Get the number of rows in each embedding sidecar file and its scales file (None for the
+        files that don't exist yet), to restore them to with _truncate_sidecars
+        """
+        row_counts = {}
+        for path in (self.conversation_embeddings_path, self.centroid_embeddings_path):
+            for sidecar_path in (path, self._scales_path(path)):
+                row_counts[sidecar_path] = (
+                    len(np.load(sidecar_path, mmap_mode="r"))
+                    if sidecar_path.exists()
+                    else None
+                )
+        return row_counts
+
+    def _truncate_sidecars(self, row_counts: Dict[Path, Optional[int]]):
+        """
+        Drop the rows appended to the sidecar files since their row counts were taken (see
+        _sidecar_row_counts), deleting the files that didn't exist then. Each embeddings file is
+        truncated before its scales file, so there are always at least as many scales as embeddings.
+        """
+        for path, n_rows in row_counts.items():
+            if n_rows is None:
+                path.unlink(missing_ok=True)
+                continue
+            if not path.exists():
+                continue
+            existing_rows = np.load(path, mmap_mode="r")
+            if len(existing_rows) > n_rows:
+                no_rows = np.empty((0, *existing_rows.shape[1:]), existing_rows.dtype)
+                del existing_rows
+                self._write_rows(path, no_rows, n_rows)
+                logger.info("Truncated %s back to %s rows", path, n_rows)
+
+    @staticmethod
+    def _save_array(path: Path, array: np.ndarray):
+        """
+        Save an array to a temporary path and swap it in with os.replace, so readers never
+        see a partially-written file (and existing memory maps keep pointing at the old one)
+        """
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _write_rows(path: Path, rows: np.ndarray, start_row: int):
+        """
+        Write rows into the 2D array saved in a .npy file, starting at row start_row (and
+        replacing any rows past it), creating the file if start_row is 0.
+
+        np.save leaves room in the .npy header for the row count to grow, so the new rows are
+        written at the end of the existing data and the header's shape is updated in place,
+        rather than rewriting the whole file. The rows are written before the header, so readers
+        never see a shape that the data doesn't cover.
+        """
+        rows = np.ascontiguousarray(rows)
+        if start_row == 0:
+            DatabaseManager._save_array(path, rows)
+            return
+
+        header = {
+            "descr": np.lib.format.dtype_to_descr(rows.dtype),
+            "fortran_order": False,
+            "shape": (start_row + len(rows), *rows.shape[1:]),
+        }
+        with open(path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                np.lib.format.read_array_header_1_0(f)
+                write_header = np.lib.format.write_array_header_1_0
+            else:
+                np.lib.format.read_array_header_2_0(f)
+                write_header = np.lib.format.write_array_header_2_0
+            data_offset = f.tell()
+
+            new_header = io.BytesIO()
+            write_header(new_header, header)
+            if len(new_header.getvalue()) == data_offset:
+                row_nbytes = rows.itemsize * int(np.prod(rows.shape[1:]))
+                f.seek(data_offset + start_row * row_nbytes)
+                f.write(rows.tobytes())
+                f.truncate()
+                f.flush()
+                f.seek(0)
+                f.write(new_header.getvalue())
+                return
+
+        # The header has no room to grow (e.g. it was written by an older NumPy), so we fall back
+        # to rewriting the file once; the rewritten header has room for the following appends
+        existing_rows = np.load(path, mmap_mode="r")[:start_row]
+        DatabaseManager._save_array(path, np.concatenate([existing_rows, rows]))
+
+    def _append_embeddings(self, path: Path, embeddings: np.ndarray) -> int:
+        """
+        Quantize a matrix of embeddings and append it to a sidecar file. Only the new rows are
+        quantized and written (see _write_rows), so the cost of an append doesn't grow with the
+        number of embeddings already stored.
+
+        Args:
+            path (Path): The sidecar file to append to
+            embeddings (np.ndarray): A 2D array of embeddings, one per row
+
+        Returns:
+            int: The row offset of the first appended embedding
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        start_row = 0
+        if path.exists():
+            existing_embeddings = np.load(path, mmap_mode="r")
+            if existing_embeddings.shape[1] != embeddings.shape[1]:
+                raise ValueError(
+                    f"Cannot append {embeddings.shape[1]}-dimensional embeddings to {path}, "
+                    f"which holds {existing_embeddings.shape[1]}-dimensional embeddings"
+                )
+            start_row = len(existing_embeddings)
+            del existing_embeddings
+
+        # The scales are written first, so a reader that loads the embeddings and then the scales
+        # always finds at least as many scales as embeddings
+        quantized, scales = quantize_embeddings(embeddings)
+        self._write_rows(self._scales_path(path), scales, start_row)
+        self._write_rows(path, quantized, start_row)
+
+        logger.debug("Wrote %s embeddings to %s", len(embeddings), path)
+        return start_row
+
+    def replace_embeddings(
+        self, conversation_embeddings: np.ndarray, centroid_embeddings: np.ndarray
+    ):
+        """
+        Replace all of the stored conversation and cluster centroid embeddings, for when the
+        tables are rebuilt from scratch (so their emb_row and centroid_row offsets start at 0).
+
+        Args:
+            conversation_embeddings (np.ndarray): A 2D array of conversation embeddings, one per row
+            centroid_embeddings (np.ndarray): A 2D array of centroid embeddings, one per row
+        """
+        for path, embeddings in (
+            (self.conversation_embeddings_path, conversation_embeddings),
+            (self.centroid_embeddings_path, centroid_embeddings),
+        ):
+            quantized, scales = quantize_embeddings(embeddings)
+            self._write_rows(self._scales_path(path), scales, 0)
+            self._write_rows(path, quantized, 0)
+
+    def append_conversation_embeddings(self, embeddings: np.ndarray) -> int:
+        """
+        Append conversation embeddings to the embeddings sidecar file.
+
+        Args:
+            embeddings (np.ndarray): A 2D array of embeddings, one per row
+
+        Returns:
+            int: The emb_row of the first appended embedding; the i-th embedding will
+            have an emb_row of (start_row + i)
+        """
+        return self._append_embeddings(self.conversation_embeddings_path, embeddings)
+
+    def append_centroid_embeddings(self, embeddings: np.ndarray) -> int:
+        """
+        Append cluster centroid embeddings to the centroid embeddings sidecar file.
+
+        Args:
+            embeddings (np.ndarray): A 2D array of centroid embeddings, one per row
+
+        Returns:
+            int: The centroid_row of the first appended embedding
+        """
+        return self._append_embeddings(self.centroid_embeddings_path, embeddings)
+
+    def _load_embeddings(
+        self, path: Path, rows: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        """
+        Load (and dequantize) embeddings from a sidecar file. The file is memory-mapped, so only
+        the requested rows are read from disk.
+
+        Args:
+            path (Path): The sidecar file to load from
+            rows (Optional[Sequence[int]]): The row offsets to load, in order. All of the rows
+                are loaded if this isn't provided.
+
+        Returns:
+            np.ndarray: A 2D float32 array of embeddings, one per requested row
+        """
+        if not path.exists():
+            return np.empty((0, 0), dtype=np.float32)
+
+        quantized = np.load(path, mmap_mode="r")
+        scales = np.load(self._scales_path(path), mmap_mode="r")[: len(quantized)]
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            quantized, scales = quantized[rows], scales[rows]
+        return quantized.astype(np.float32) * scales
+
+    def get_conversation_embeddings(
+        self, emb_rows: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        """
+        Get conversation embeddings (e.g. for downstream analysis) by their emb_row offsets.
+
+        Args:
+            emb_rows (Optional[Sequence[int]]): The conversations' emb_row values. All of the
+                conversation embeddings are returned if this isn't provided.
+
+        Returns:
+            np.ndarray: A 2D float32 array of embeddings, in the order of emb_rows
+        """
+        return self._load_embeddings(self.conversation_embeddings_path, emb_rows)
+
+    def get_centroid_embeddings(
+        self, centroid_rows: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        """
+        Get cluster centroid embeddings by their centroid_row offsets.
+
+        Args:
+            centroid_rows (Optional[Sequence[int]]): The clusters' centroid_row values. All of
+                the centroid embeddings are returned if this isn't provided.
+
+        Returns:
+            np.ndarray: A 2D float32 array of centroid embeddings, in the order of centroid_rows
+        """
+        return self._load_embeddings(self.centroid_embeddings_path, centroid_rows)
+
+    def _data_signature(self) -> Tuple:
+        """
+        The modification time and size of the database file and its WAL file. Committing a write
+        (which, in WAL mode, appends to the WAL) or checkpointing changes it, including when the
+        write comes from the processing worker's process.
+        """
+        signature = []
+        for path in (self.db_path, self.db_path.with_name(f"{self.db_path.name}-wal")):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
     def has_data(self) -> bool:
         """
         Check if database has any processed conversations.
@@ -99,18 +578,32 @@ class DatabaseManager:
             bool: True if there are conversations in the database, False otherwise.
             Returns False if conversations table doesn't exist.
         """
+        # Once there's data, there'll always be data; so we only need to query until we see some,
+        # and only again once the database has been written to since we last saw none
+        if self._has_data_cached:
+            return True
+        signature = self._data_signature()
+        if signature == self._no_data_signature:
+            return False
+
         logger.debug("Checking if database has any processed conversations")
         sqlite3 = get_sqlite3()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.read_conn as conn:
                 cursor = conn.cursor()
-                result = cursor.execute("SELECT COUNT(*) FROM conversations").fetchone()
-                has_data = result[0] > 0
-                logger.debug(f"Database has data: {has_data}")
-                return has_data
+                result = cursor.execute(
+                    "SELECT EXISTS (SELECT 1 FROM conversations)"
+                ).fetchone()
+                has_data = bool(result[0])
+                logger.debug("Database has data: %s", has_data)
+                self._has_data_cached = has_data
         except sqlite3.OperationalError:
             logger.debug("Conversations table does not exist")
-            return False
+            has_data = False
+
+        if not has_data:
+            self._no_data_signature = signature
+        return has_data
 
     def get_clusters_in_solution(
         self, clustering_solution_id: str
@@ -124,15 +617,22 @@ class DatabaseManager:
         Returns:
             ClusteringResults: Object containing cluster metrics and metadata
         """
+        cached_results = self._clusters_in_solution_cache.get(clustering_solution_id)
+        if cached_results is not None:
+            logger.debug(
+                "Using cached clustering results for %s", clustering_solution_id
+            )
+            return cached_results
+
         logger.info(
-            f"Retrieving clustering results for solution {clustering_solution_id} from database"
+            "Retrieving clustering results for solution %s from database",
+            clustering_solution_id,
         )
-        sqlite3 = get_sqlite3()
-        with sqlite3.connect(self.db_path) as conn:
+        with self.read_conn as conn:
             cursor = conn.cursor()
 
             logger.debug(
-                f"Executing query to get clustering solution {clustering_solution_id}"
+                "Executing query to get clustering solution %s", clustering_solution_id
             )
             cursor.execute(
                 """
@@ -159,43 +659,91 @@ class DatabaseManager:
             clusters = []
             logger.debug("Processing query results")
             for row in cursor.fetchall():
+                # The rows were written by our own pipeline, so we skip re-validating them
                 clusters.append(
-                    {
-                        "cluster_id": row[0],
-                        "conversation_ids": json.loads(row[1]),
-                        "centroid_conversation_ids": json.loads(row[2]),
-                        "cluster_size": row[3],
-                        "cluster_label": row[4],
-                        "cluster_description": row[5],
-                        "tag_counts": json.loads(row[6]),
-                        "mean_cosine_similarity": row[7],
-                        "cluster_radius": row[8],
-                        "silhouette_score": row[9],
-                        "centroid_umap_x": row[10],
-                        "centroid_umap_y": row[11],
-                    }
+                    ClusterMetrics.model_construct(
+                        cluster_id=row[0],
+                        conversation_ids=orjson.loads(row[1]),
+                        centroid_conversation_ids=orjson.loads(row[2]),
+                        cluster_size=row[3],
+                        cluster_label=row[4],
+                        cluster_description=row[5],
+                        tag_counts=orjson.loads(row[6]),
+                        mean_cosine_similarity=row[7],
+                        cluster_radius=row[8],
+                        silhouette_score=row[9],
+                        centroid_umap_x=row[10],
+                        centroid_umap_y=row[11],
+                    )
                 )
 
             logger.info(
-                f"Retrieved {len(clusters)} clusters from solution {clustering_solution_id}"
+                "Retrieved %s clusters from solution %s",
+                len(clusters),
+                clustering_solution_id,
             )
-            return ClusteringResults(
+            results = ClusteringResults.model_construct(
                 cluster_solution_id=clustering_solution_id, clusters=clusters
             )
 
+            # A solution's clusters are all written in the same transaction, so if we found any,
+            # we found all of them
+            if clusters:
+                self._clusters_in_solution_cache[clustering_solution_id] = results
+            return results
+
+    def get_clusters_in_solution_json(
+        self, clustering_solution_id: str
+    ) -> Tuple[bytes, str]:
+        """
+        Get clustering results for a specific clustering solution, already serialized to JSON.
+        Since a committed solution never changes, the serialized results are cached.
+
+        Args:
+            clustering_solution_id (str): The ID of the clustering solution to retrieve.
+
+        Returns:
+            Tuple[bytes, str]: The JSON-serialized ClusteringResults, and an ETag for them
+        """
+        cached_results = self._clusters_in_solution_json_cache.get(
+            clustering_solution_id
+        )
+        if cached_results is not None:
+            return cached_results
+
+        results = self.get_clusters_in_solution(clustering_solution_id)
+        results_json = orjson.dumps(results.model_dump(mode="json"))
+        etag = f'"{hashlib.sha1(results_json).hexdigest()}"'
+
+        if results.clusters:
+            self._clusters_in_solution_json_cache[clustering_solution_id] = (
+                results_json,
+                etag,
+            )
+        return results_json, etag
+
     def get_cluster_solutions(self) -> List[dict]:
         """
-        Get list of all cluster solutions with their IDs and number of clusters
+        Get list of all cluster solutions with their IDs and number of clusters. The list is
+        cached until the database is next written to.
         """
+        signature = self._data_signature()
+        if (
+            self._cluster_solutions_cache is not None
+            and self._cluster_solutions_cache[0] == signature
+        ):
+            return self._cluster_solutions_cache[1]
+
         logger.debug("Getting list of cluster solutions")
-        sqlite3 = get_sqlite3()
-        with sqlite3.connect(self.db_path) as conn:
+        with self.read_conn as conn:
             cursor = conn.cursor()
+            # (cluster_solution_id, cluster_id) is the primary key, so this is a scan of its index,
+            # and a plain COUNT(*) counts distinct clusters without a temporary B-tree
             cursor.execute(
                 """
                 SELECT 
                     cluster_solution_id,
-                    COUNT(DISTINCT cluster_id) as n_clusters
+                    COUNT(*) as n_clusters
                 FROM clusters
                 GROUP BY cluster_solution_id
                 ORDER BY cluster_solution_id DESC
@@ -207,8 +755,73 @@ class DatabaseManager:
                 for row in cursor.fetchall()
             ]
 
-            logger.info(f"Retrieved {len(solutions)} cluster solutions")
-            return solutions
+            logger.info("Retrieved %s cluster solutions", len(solutions))
+
+        # The signature was taken before querying, so a write that lands in between just
+        # means one extra query next time
+        self._cluster_solutions_cache = (signature, solutions)
+        return solutions
+
+    def get_cluster_solutions_json(self) -> Tuple[bytes, str]:
+        """
+        Get the list of cluster solutions (see get_cluster_solutions), already serialized to JSON.
+
+        Returns:
+            Tuple[bytes, str]: The JSON-serialized list of cluster solutions, and an ETag for it
+        """
+        solutions = self.get_cluster_solutions()
+        cached_results = self._cluster_solutions_json_cache
+        if cached_results is not None and cached_results[0] is solutions:
+            return cached_results[1], cached_results[2]
+
+        solutions_json = orjson.dumps(solutions)
+        etag = f'"{hashlib.sha1(solutions_json).hexdigest()}"'
+        self._cluster_solutions_json_cache = (solutions, solutions_json, etag)
+        return solutions_json, etag
+
+    def _query_conversations_by_cluster_solution(self, conn, cluster_solution_id: str):
+        """
+        Execute the query for the (conversation_id, title, umap_x, umap_y, cluster_id) row of
+        every conversation for a given cluster solution, returning its cursor
+        """
+        logger.debug(
+            "Getting conversations for cluster solution %s", cluster_solution_id
+        )
+        # The solution's cluster assignments are unpacked once, and then each one looks up its
+        # conversation by primary key, rather than testing every conversation against every
+        # conversation ID in the solution. Only the solution's conversations are returned
+        # (uploads add to the conversations table, so older solutions don't cover every
+        # conversation), unless the solution has no clusters, in which case every conversation
+        # is returned without a cluster
+        return conn.execute(
+            """
+            WITH cluster_assignments AS (
+                SELECT conv_ids.value AS conversation_id, cl.cluster_id
+                FROM clusters cl, json_each(cl.conversation_ids) AS conv_ids
+                WHERE cl.cluster_solution_id = ?
+            )
+            SELECT 
+                c.conversation_id,
+                c.title,
+                c.umap_x,
+                c.umap_y,
+                a.cluster_id
+            FROM conversations c
+            JOIN cluster_assignments a ON a.conversation_id = c.conversation_id
+            UNION ALL
+            SELECT 
+                c.conversation_id,
+                c.title,
+                c.umap_x,
+                c.umap_y,
+                NULL
+            FROM conversations c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM clusters WHERE cluster_solution_id = ?
+            )
+            """,
+            (cluster_solution_id, cluster_solution_id),
+        )
 
     def get_conversations_by_cluster_solution(
         self, cluster_solution_id: str
@@ -222,42 +835,65 @@ class DatabaseManager:
         Returns:
             List[Conversation]: List of conversations with cluster assignments
         """
-        logger.debug(
-            f"Getting conversations for cluster solution {cluster_solution_id}"
+        with self.read_conn as conn:
+            rows = self._query_conversations_by_cluster_solution(
+                conn, cluster_solution_id
+            ).fetchall()
+        logger.info(
+            "Retrieved %s conversations for cluster solution %s",
+            len(rows),
+            cluster_solution_id,
         )
-        sqlite3 = get_sqlite3()
-
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT 
-                    c.conversation_id,
-                    c.title,
-                    c.umap_x,
-                    c.umap_y,
-                    cl.cluster_id
-                FROM conversations c
-                LEFT JOIN clusters cl ON cl.cluster_solution_id = ?
-                LEFT JOIN json_each(cl.conversation_ids) as conv_ids
-                WHERE conv_ids.value = c.conversation_id OR conv_ids.value IS NULL
-                """,
-                (cluster_solution_id,),
+        return [
+            Conversation.model_construct(
+                conversation_id=conversation_id,
+                title=title,
+                umap_x=umap_x,
+                umap_y=umap_y,
+                cluster_id=cluster_id,
             )
+            for conversation_id, title, umap_x, umap_y, cluster_id in rows
+        ]
 
-            conversations = []
-            for row in cursor.fetchall():
-                conversations.append(
-                    Conversation(
-                        conversation_id=row[0],
-                        title=row[1],
-                        umap_x=row[2],
-                        umap_y=row[3],
-                        cluster_id=row[4],
-                    )
-                )
+    def iter_conversations_by_cluster_solution_json(
+        self, cluster_solution_id: str
+    ) -> Iterator[bytes]:
+        """
+        Stream all conversations for a given cluster solution (see get_conversations_by_cluster_solution)
+        as chunks of a JSON array, serialized straight from batches of rows, without building a
+        Conversation model for each one (or the whole array at once).
 
-            logger.info(
-                f"Retrieved {len(conversations)} conversations for cluster solution {cluster_solution_id}"
+        Args:
+            cluster_solution_id (str): ID of the cluster solution to get conversations for
+
+        Yields:
+            bytes: Consecutive chunks of the JSON-serialized list of conversations
+        """
+        # A streaming response may resume this generator on a different threadpool thread for
+        # each chunk, so it uses its own connection rather than the thread's read connection
+        conn = self._connect(check_same_thread=False)
+        try:
+            cursor = self._query_conversations_by_cluster_solution(
+                conn, cluster_solution_id
             )
-            return conversations
+            yield b"["
+            separator = b""
+            while rows := cursor.fetchmany(CONVERSATION_STREAM_BATCH_SIZE):
+                # Each batch is serialized as an array, whose brackets we strip to splice it in
+                batch_json = orjson.dumps(
+                    [
+                        {
+                            "conversation_id": conversation_id,
+                            "title": title,
+                            "cluster_id": cluster_id,
+                            "umap_x": umap_x,
+                            "umap_y": umap_y,
+                        }
+                        for conversation_id, title, umap_x, umap_y, cluster_id in rows
+                    ]
+                )
+                yield separator + batch_json[1:-1]
+                separator = b","
+            yield b"]"
+        finally:
+            conn.close()
@@ -13,16 +13,29 @@ from utils.logging import configure_logging
 configure_logging()
 
 # General imports
-import json
+import asyncio
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from typing import List
 
 # Third-party imports
-from fastapi import FastAPI, UploadFile, BackgroundTasks, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 # Project imports
-from processing import ProcessingService
+from processing import (
+    ProcessingService,
+    run_processing_job,
+    warm_up_processing_worker,
+)
 from database import DatabaseManager
 from models import ProcessingStatus, ClusteringResults, Conversation
 
@@ -34,11 +47,38 @@ logger = logging.getLogger(__name__)
 # ===================
 # We'll start by configuring the FastAPI app.
 
-# Create FastAPI app instance
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up the processing worker (see below) when the app starts, and stop it and close the
+    database connections when the app shuts down
+    """
+    # Compile UMAP's numba kernels in the worker process before the first upload needs them
+    logger.info("Warming up the processing worker")
+    warm_up_job = asyncio.get_running_loop().run_in_executor(
+        processing_executor, warm_up_processing_worker
+    )
+    warm_up_job.add_done_callback(_log_processing_job_errors)
+
+    yield
+
+    logger.info("Shutting down the processing worker and database connections")
+    # Queued jobs are dropped, but we don't block on a running job. Its writes are transactional
+    # (including the embedding sidecar appends, which are truncated on rollback), so a job that
+    # fails leaves the data as it was before the upload; a worker that's killed outright can at
+    # most leave unreferenced rows at the end of the sidecar files
+    processing_executor.shutdown(wait=False, cancel_futures=True)
+    db.close()
+
+
+# Create FastAPI app instance (responses are serialized with orjson)
 app = FastAPI(
     title="Chat GPT Explorer API",
     description="API for exploring Chat GPT conversations",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Add CORS middleware for local deployment
@@ -50,6 +90,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# The conversation and cluster listings are large, repetitive JSON, so we compress anything
+# bigger than a small status response (a low compression level keeps the CPU cost small)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
 # ===================
 # DECLARING ENDPOINTS
 # ===================
@@ -59,35 +103,73 @@ logger.info("Initializing database and processing services")
 db = DatabaseManager("data/conversations.db")
 processor = ProcessingService(db)
 
+# Uploads are processed in a dedicated worker process, so the CPU-bound pipeline doesn't starve
+# the request handlers; I/O-bound work (like spooling uploads) stays on the default threadpool.
+# We spawn (rather than fork) so the worker doesn't inherit this process's SQLite connections.
+# There's a single worker, so uploads are processed one at a time, and never contend for writes.
+processing_executor = ProcessPoolExecutor(
+    max_workers=1,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=configure_logging,
+)
 
-@app.post("/upload")
-async def upload_conversations(
-    file: UploadFile, background_tasks: BackgroundTasks
-) -> ProcessingStatus:
-    """Handle initial file upload and start processing"""
-    logger.info(f"Received file upload: {file.filename}")
 
-    # Save file temporarily
-    content = await file.read()
-    conversations = json.loads(content)
+def _log_processing_job_errors(future):
+    """Log any exception that escaped a processing job"""
+    exception = future.exception()
+    if exception is not None:
+        logger.error("Processing job failed: %s", exception, exc_info=exception)
 
-    # Start processing in background task
-    logger.info("Starting processing in background task")
-    background_tasks.add_task(processor.process_conversations, conversations)
+
+@app.post("/upload")
+async def upload_conversations(file: UploadFile) -> ProcessingStatus:
+    """Handle initial file upload and start processing"""
+    logger.info("Received file upload: %s", file.filename)
+
+    # Spool the upload to disk, so only its path needs to be handed to the worker process (which
+    # deletes the file once it's done). If the upload fails part-way, the partial file is removed
+    with tempfile.NamedTemporaryFile(
+        dir="data", suffix=".json", delete=False
+    ) as upload_file:
+        try:
+            await run_in_threadpool(shutil.copyfileobj, file.file, upload_file)
+        except BaseException:
+            upload_file.close()
+            os.unlink(upload_file.name)
+            raise
+
+    # Start processing in the worker process
+    logger.info("Starting processing in worker process")
+    try:
+        processing_job = asyncio.get_running_loop().run_in_executor(
+            processing_executor, run_processing_job, str(db.db_path), upload_file.name
+        )
+    except BaseException:
+        # The job never started (e.g. the worker pool is broken), so nothing else will
+        # delete the spooled upload
+        os.unlink(upload_file.name)
+        raise
+    processing_job.add_done_callback(_log_processing_job_errors)
 
     return ProcessingStatus(
         status="processing", message="Started processing conversations", progress=0
     )
 
 
-@app.get("/processing-status")
-async def get_processing_status() -> ProcessingStatus:
+@app.get("/processing-status", response_model=ProcessingStatus)
+async def get_processing_status() -> Response:
     """Get current processing status"""
-    return processor.get_status()
+    # This endpoint is polled throughout processing, so we return the cached, pre-serialized status
+    return Response(content=processor.get_status_json(), media_type="application/json")
 
 
-@app.get("/conversations/clusters-in-solution/{clustering_solution_id}")
-async def get_clusters_in_solution(clustering_solution_id: str) -> ClusteringResults:
+@app.get(
+    "/conversations/clusters-in-solution/{clustering_solution_id}",
+    response_model=ClusteringResults,
+)
+async def get_clusters_in_solution(
+    clustering_solution_id: str, request: Request
+) -> Response:
     """Get clustering results for a specific solution
 
     Args:
@@ -99,33 +181,53 @@ async def get_clusters_in_solution(clustering_solution_id: str) -> ClusteringRes
     Raises:
         HTTPException: If no conversation data exists in database
     """
-    if not db.has_data():
+    # The database calls block, so we run them in the threadpool to keep the event loop free for
+    # other requests (like the processing status polling)
+    if not await run_in_threadpool(db.has_data):
         logger.warning("No conversation data found in database")
         raise HTTPException(404, "No conversation data found")
-    results = db.get_clusters_in_solution(clustering_solution_id)
-    return results
+
+    # The results are cached pre-serialized, and the client can revalidate them with the ETag
+    results_json, etag = await run_in_threadpool(
+        db.get_clusters_in_solution_json, clustering_solution_id
+    )
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=results_json, media_type="application/json", headers={"ETag": etag}
+    )
 
 
 @app.get("/has-data")
 async def check_data_exists() -> bool:
     """Check if any conversation data exists in the database"""
-    return db.has_data()
+    return await run_in_threadpool(db.has_data)
 
 
-@app.get("/conversations/cluster-solutions")
-async def get_cluster_solutions() -> List[dict]:
+@app.get("/conversations/cluster-solutions", response_model=List[dict])
+async def get_cluster_solutions(request: Request) -> Response:
     """Get list of all cluster solutions with their IDs and number of clusters"""
-    if not db.has_data():
+    if not await run_in_threadpool(db.has_data):
         logger.warning("No conversation data found in database")
         raise HTTPException(404, "No conversation data found")
-    solutions = db.get_cluster_solutions()
-    return solutions
+
+    # The list is cached pre-serialized (until the database changes), and the client can
+    # revalidate it with the ETag
+    solutions_json, etag = await run_in_threadpool(db.get_cluster_solutions_json)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=solutions_json, media_type="application/json", headers={"ETag": etag}
+    )
 
 
-@app.get("/conversations/by-cluster-solution/{clustering_solution_id}")
+@app.get(
+    "/conversations/by-cluster-solution/{clustering_solution_id}",
+    response_model=List[Conversation],
+)
 async def get_conversations_by_cluster_solution(
     clustering_solution_id: str,
-) -> List[Conversation]:
+) -> Response:
     """Get all conversations for a given cluster solution, including their cluster assignments
 
     Args:
@@ -137,8 +239,15 @@ async def get_conversations_by_cluster_solution(
     Raises:
         HTTPException: If no conversation data exists in database
     """
-    if not db.has_data():
+    if not await run_in_threadpool(db.has_data):
         logger.warning("No conversation data found in database")
         raise HTTPException(404, "No conversation data found")
-    conversations = db.get_conversations_by_cluster_solution(clustering_solution_id)
-    return conversations
+
+    # This can be every conversation in the export, so the rows are serialized directly with
+    # orjson (rather than being validated and encoded as Conversation models), and streamed in
+    # batches as they're read, rather than buffering the whole array first. Starlette iterates
+    # the (blocking) generator in the threadpool.
+    return StreamingResponse(
+        db.iter_conversations_by_cluster_solution_json(clustering_solution_id),
+        media_type="application/json",
+    )
@@ -8,16 +8,17 @@ This module handles conversation processing and analysis for the ChatGPT Explore
 # Below, we'll set up the processing service class.
 
 # General imports
-import json
 import math
-import sqlite3
+import os
+import time
 import warnings
-from typing import Dict, Any
+from functools import partial
+from typing import Dict, Any, Iterable, List, Tuple
 import logging
 from importlib import import_module
-from functools import lru_cache
 
 # Third-party imports
+import orjson
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
@@ -25,12 +26,114 @@ from tqdm import tqdm
 # Project imports
 import utils.settings as settings
 import utils.data_parsing as data_utils
+from database import DatabaseManager
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Ignore warnings
-warnings.filterwarnings("ignore")
+# The minimum number of seconds between progress updates written by the progress callbacks
+PROGRESS_UPDATE_INTERVAL_S = 0.25
+
+# The status reported before any upload has been processed
+IDLE_STATUS = {"status": "idle", "message": "", "progress": 0}
+
+# The columns of the conversations table that are populated when an export is first parsed
+INITIAL_CONVERSATION_COLUMNS = [
+    "conversation_id",
+    "title",
+    "create_time",
+    "default_model_slug",
+    "raw_messages_data",
+    "messages_markdown",
+]
+
+# The columns of the clusters table, in the order that cluster rows are built in
+CLUSTER_COLUMNS = [
+    "cluster_solution_id",
+    "cluster_id",
+    "conversation_ids",
+    "centroid_conversation_ids",
+    "centroid_row",
+    "cluster_size",
+    "cluster_label",
+    "cluster_description",
+    "tag_counts",
+    "mean_cosine_similarity",
+    "cluster_radius",
+    "silhouette_score",
+    "centroid_umap_x",
+    "centroid_umap_y",
+]
+
+
+def _dumps_json(obj: Any) -> str:
+    """Serialize an object to a JSON string, for storage in a TEXT column"""
+    return orjson.dumps(obj).decode()
+
+
+def _import_umap_class():
+    """
+    Import the UMAP class to use. This is RAPIDS cuML's GPU implementation when it's installed
+    and a CUDA device is available, and umap-learn's CPU implementation otherwise (with
+    settings.UMAP_CPU_KWARGS bound in); both take and return NumPy arrays.
+    """
+    try:
+        import cupy
+        from cuml.manifold import UMAP
+
+        if cupy.cuda.runtime.getDeviceCount() > 0:
+            return UMAP
+    except Exception:
+        # cuML / CuPy aren't installed, or there's no usable CUDA device
+        pass
+
+    from umap import UMAP
+
+    return partial(UMAP, **settings.UMAP_CPU_KWARGS)
+
+
+# ====================
+# CONVERSATION PARSING
+# ====================
+# Parsing runs in the processing worker process (see run_processing_job), so it's already off the
+# API process; it's done inline there, rather than paying to spawn a nested pool of processes
+# (and re-import everything in each of them) for every upload.
+
+
+def _parse_conversation(conversation: dict) -> tuple:
+    """
+    Parse a conversation from the export into a tuple of values that follows the order of
+    INITIAL_CONVERSATION_COLUMNS
+    """
+    messages = data_utils.extract_longest_conversation_messages(
+        mapping=conversation.get("mapping", {})
+    )
+    return (
+        conversation.get("conversation_id"),
+        conversation.get("title", "UNTITLED CONVERSATION"),
+        conversation.get("create_time"),
+        conversation.get("default_model_slug"),
+        _dumps_json(messages),
+        data_utils.extract_simple_conversation_markdown(messages=messages),
+    )
+
+
+def parse_conversations(conversations: Iterable[dict]) -> List[tuple]:
+    """
+    Parse every conversation in an export, keeping their order.
+
+    Args:
+        conversations (Iterable[dict]): The conversations to parse; this can be a
+            lazily-parsed stream, since it's only iterated once
+
+    Returns:
+        List[tuple]: The parsed conversations (see _parse_conversation)
+    """
+    return [
+        _parse_conversation(conversation)
+        for conversation in tqdm(conversations, desc="Processing conversations")
+    ]
+
 
 # ===================
 # PROCESSING SERVICE
@@ -40,11 +143,20 @@ warnings.filterwarnings("ignore")
 
 
 class ProcessingService:
-    def __init__(self, db_manager):
-        """Initialize the processing service with a database manager"""
+    def __init__(self, db_manager, reset_status: bool = True):
+        """Initialize the processing service with a database manager
+
+        Args:
+            db_manager (DatabaseManager): The database manager to read and write through
+            reset_status (bool): Whether to reset the status file to "idle". Worker processes
+                pass False, so they don't clobber the status of a job that's being started.
+        """
         self.db = db_manager
         self.status_file = "data/processing_status.json"
-        self._initialize_status()
+        self._status_cache = None  # (file signature, status dict, status JSON bytes)
+        self._last_status_write = 0.0
+        if reset_status:
+            self._initialize_status()
         self._umap = None
         self._llm_utils = None
         self._openai_utils = None
@@ -52,37 +164,72 @@ class ProcessingService:
 
     def _initialize_status(self):
         """Initialize or reset the status file"""
-        initial_status = {"status": "idle", "message": "", "progress": 0}
-        self._update_status_file(initial_status)
+        self._update_status_file(IDLE_STATUS)
+
+    def _update_status_file(self, status_data: Dict[str, Any], final: bool = True):
+        """
+        Update the status file with new status information
+
+        Args:
+            status_data (Dict[str, Any]): The status to write
+            final (bool): Whether the write must happen. Non-final writes (i.e., intermediate
+                progress updates) are throttled to one every PROGRESS_UPDATE_INTERVAL_S seconds.
+        """
+        now = time.monotonic()
+        if not final and now - self._last_status_write < PROGRESS_UPDATE_INTERVAL_S:
+            return
+        self._last_status_write = now
 
-    def _update_status_file(self, status_data: Dict[str, Any]):
-        """Update the status file with new status information"""
         try:
-            with open(self.status_file, "w") as f:
-                json.dump(status_data, f)
+            # Write to a temporary file and swap it in, so readers never see a partial write
+            tmp_status_file = f"{self.status_file}.tmp"
+            with open(tmp_status_file, "wb") as f:
+                f.write(orjson.dumps(status_data))
+            os.replace(tmp_status_file, self.status_file)
         except Exception as e:
-            logger.error(f"Error updating status file: {e}")
+            logger.error("Error updating status file: %s", e)
 
-    def get_status(self) -> Dict[str, Any]:
-        """Get current processing status from file"""
+    def _read_status(self, retry: bool = True) -> Tuple[Dict[str, Any], bytes]:
+        """
+        Read the current status and its serialized JSON, re-reading the status file only
+        when its modification time (or size) has changed since the last read
+
+        Args:
+            retry (bool): Whether to (re)create a missing status file and read it again. If
+                it's still missing (e.g. because it couldn't be written), the idle status is
+                returned instead.
+        """
         try:
-            with open(self.status_file, "r") as f:
-                return json.load(f)
+            stat = os.stat(self.status_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._status_cache is None or self._status_cache[0] != signature:
+                with open(self.status_file, "rb") as f:
+                    status_json = f.read()
+                self._status_cache = (signature, orjson.loads(status_json), status_json)
+            return self._status_cache[1], self._status_cache[2]
         except FileNotFoundError:
-            self._initialize_status()
-            return self.get_status()
+            if retry:
+                self._initialize_status()
+                return self._read_status(retry=False)
+            return dict(IDLE_STATUS), orjson.dumps(IDLE_STATUS)
         except Exception as e:
-            logger.error(f"Error reading status file: {e}")
-            return {"status": "error", "message": str(e), "progress": 0}
+            logger.error("Error reading status file: %s", e)
+            error_status = {"status": "error", "message": str(e), "progress": 0}
+            return error_status, orjson.dumps(error_status)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get current processing status from file"""
+        return self._read_status()[0]
+
+    def get_status_json(self) -> bytes:
+        """Get current processing status from file, already serialized to JSON"""
+        return self._read_status()[1]
 
     @property
-    @lru_cache()
     def umap(self):
-        """Lazy load UMAP"""
+        """Lazy load UMAP (on the GPU, if one is available)"""
         if self._umap is None:
-            from umap import UMAP
-
-            self._umap = UMAP
+            self._umap = _import_umap_class()
         return self._umap
 
     @property
@@ -106,40 +253,26 @@ class ProcessingService:
             self._cluster_utils = import_module("utils.clusters")
         return self._cluster_utils
 
-    def process_conversations(self, conversations: list):
+    def process_conversations(self, conversations: Iterable[dict]):
         """
         Process conversations in background, including parsing, embedding generation,
         and clustering analysis.
 
         Args:
-            conversations (list): List of conversation data to process
+            conversations (Iterable[dict]): Conversation data to process; this can be a
+                lazily-parsed stream, since it's only iterated once
         """
         try:
 
-            # Determine the number of conversations
-            n_conversations = len(conversations)
-
             # Initialize database tables
             self.db.initialize_database()
 
-            # Process conversations and prepare initial data
-            conversations_data_to_insert = []
-            for conversation in tqdm(conversations, desc="Processing conversations"):
-                messages_df = data_utils.extract_longest_conversation_df(
-                    mapping=conversation.get("mapping", {})
-                )
+            # Process conversations and prepare initial data, as tuples of values that follow
+            # the order of INITIAL_CONVERSATION_COLUMNS
+            conversations_data_to_insert = parse_conversations(conversations)
 
-                cur_conversation_data = {
-                    "conversation_id": conversation.get("conversation_id"),
-                    "title": conversation.get("title", "UNTITLED CONVERSATION"),
-                    "create_time": conversation.get("create_time"),
-                    "default_model_slug": conversation.get("default_model_slug"),
-                    "raw_messages_data": messages_df.to_json(),
-                    "messages_markdown": data_utils.extract_simple_conversation_markdown(
-                        conversation_df=messages_df
-                    ),
-                }
-                conversations_data_to_insert.append(cur_conversation_data)
+            # Determine the number of conversations
+            n_conversations = len(conversations_data_to_insert)
 
             # Update status as processing progresses
             self._update_status_file(
@@ -150,262 +283,290 @@ class ProcessingService:
                 }
             )
 
-            # Insert initial conversation data
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    """
-                    INSERT INTO conversations (
-                        conversation_id,
-                        title,
-                        create_time,
-                        default_model_slug,
-                        raw_messages_data,
-                        messages_markdown
-                    ) VALUES (
-                        :conversation_id,
-                        :title,
-                        :create_time,
-                        :default_model_slug,
-                        :raw_messages_data,
-                        :messages_markdown
+            # All of the writes go into a single transaction (so there's one commit at the end),
+            # with a savepoint around each stage; until it commits, readers keep seeing the
+            # previously-processed data. Any secondary indexes are rebuilt once, before committing.
+            # One OpenAI client (and connection pool) and rate limit budget are shared by all of
+            # the job's requests, which are run on the session's event loop
+            with self.db.write_transaction(
+                deferred_index_tables=("conversations", "clusters")
+            ) as conn, self.openai_utils.open_openai_session(
+                gpt_model=settings.DEFAULT_GPT_MODEL,
+                max_parallel_requests=settings.MAX_CONCURRENT_OPENAI_REQUESTS,
+            ) as (
+                openai_client,
+                rate_limit_budget,
+                run_openai_coroutine,
+            ):
+                # Insert initial conversation data
+                with self.db.savepoint("insert_conversations"):
+                    self.db.bulk_insert(
+                        conn,
+                        "conversations",
+                        INITIAL_CONVERSATION_COLUMNS,
+                        conversations_data_to_insert,
                     )
-                    """,
-                    conversations_data_to_insert,
-                )
 
-            # Enrich conversations with LLM summaries and tags
-            def llm_conversation_enrichment_progress_manager(completed_items: int):
-                # Calculate percentage complete (5-25% range)
-                percent_complete = 5 + (completed_items / n_conversations) * 20
-                # Only call progress_callback when we hit another 10% increment
-                if int(percent_complete / 1) > int(
-                    (5 + ((completed_items - 1) / n_conversations * 20)) / 1
-                ):
+                # Enrich conversations with LLM summaries and tags, and embed them; each shard
+                # of conversations is embedded while the next one is being enriched, so the
+                # progress covers both stages (5-75% range)
+                n_enriched = 0
+                n_embedded = 0
+
+                def report_enrichment_and_embedding_progress():
+                    percent_complete = (
+                        5 + (n_enriched + n_embedded) / (2 * n_conversations) * 70
+                    )
+                    # Status writes are throttled (except for the last item), since this is
+                    # called for every completed item
                     self._update_status_file(
                         {
                             "status": "processing",
-                            "message": f"Enriching conversations with LLM summaries and tags ({completed_items:,}/{n_conversations:,})",
+                            "message": f"Enriching and embedding conversations ({n_enriched:,}/{n_conversations:,} enriched, {n_embedded:,}/{n_conversations:,} embedded)",
                             "progress": int(percent_complete),
-                        }
+                        },
+                        final=n_enriched + n_embedded >= 2 * n_conversations,
                     )
 
-            llm_enriched_conversations_df = self.llm_utils.enrich_conversations_with_summaries_and_tags(
-                conversations_df=pd.DataFrame(conversations_data_to_insert),
-                max_chars_per_conversation_context=settings.MAX_CHARS_PER_CONVERSATION_CONTEXT,
-                progress_callback=llm_conversation_enrichment_progress_manager,
-            )
+                def llm_conversation_enrichment_progress_manager(completed_items: int):
+                    nonlocal n_enriched
+                    n_enriched = completed_items
+                    report_enrichment_and_embedding_progress()
+
+                def iter_embedding_texts(enriched_shard_df: pd.DataFrame):
+                    # Build the text to embed for each conversation lazily, so that only the
+                    # texts of the batches currently being embedded are held in memory. A missing
+                    # title or summary is rendered as "None", as it always has been
+                    return (
+                        "".join(
+                            [
+                                str(title),
+                                "\nTags: ",
+                                ", ".join(tags) if tags else "",
+                                "\nSummary: ",
+                                summary if isinstance(summary, str) else "None",
+                                "\nConversation: ",
+                                messages_markdown[
+                                    : settings.MAX_CHARS_PER_CONVERSATION_CONTEXT
+                                ],
+                            ]
+                        )
+                        for title, tags, summary, messages_markdown in zip(
+                            enriched_shard_df["title"],
+                            enriched_shard_df["tags"],
+                            enriched_shard_df["summary"],
+                            enriched_shard_df["messages_markdown"],
+                        )
+                    )
 
-            # Update conversations with summaries and tags
-            conversations_data_to_insert = [
-                {
-                    "conversation_id": row.conversation_id,
-                    "summary": row.summary,
-                    "tags": json.dumps(row.tags),
-                }
-                for row in llm_enriched_conversations_df.itertuples()
-            ]
-
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    """
-                    UPDATE conversations
-                    SET summary = :summary, tags = :tags
-                    WHERE conversation_id = :conversation_id
-                    """,
-                    conversations_data_to_insert,
+                async def enrich_and_embed_conversations():
+                    async def embed_enriched_shard(enriched_shard_df: pd.DataFrame):
+                        n_shard_embedded = 0
+
+                        def openai_embedding_progress_manager(completed_items: int):
+                            nonlocal n_embedded, n_shard_embedded
+                            n_embedded += completed_items - n_shard_embedded
+                            n_shard_embedded = completed_items
+                            report_enrichment_and_embedding_progress()
+
+                        return (
+                            await self.openai_utils.generate_embeddings_for_texts_async(
+                                text_list=iter_embedding_texts(enriched_shard_df),
+                                show_progress=False,
+                                progress_callback=openai_embedding_progress_manager,
+                                openai_client=openai_client,
+                            )
+                        )
+
+                    # Only the columns used by the rest of the pipeline are loaded into the
+                    # DataFrame (in particular, not the raw messages JSON)
+                    return await self.llm_utils.enrich_conversations_in_shards_async(
+                        conversations_df=pd.DataFrame.from_records(
+                            conversations_data_to_insert,
+                            columns=INITIAL_CONVERSATION_COLUMNS,
+                            exclude=[
+                                "create_time",
+                                "default_model_slug",
+                                "raw_messages_data",
+                            ],
+                        ),
+                        process_enriched_shard=embed_enriched_shard,
+                        max_chars_per_conversation_context=settings.MAX_CHARS_PER_CONVERSATION_CONTEXT,
+                        progress_callback=llm_conversation_enrichment_progress_manager,
+                        openai_client=openai_client,
+                        rate_limit_budget=rate_limit_budget,
+                    )
+
+                llm_enriched_conversations_df, shard_embs = run_openai_coroutine(
+                    enrich_and_embed_conversations()
                 )
+                embs = np.concatenate(shard_embs)
 
-            # Update status as processing progresses
-            self._update_status_file(
-                {
-                    "status": "processing",
-                    "message": "Generating conversation embeddings",
-                    "progress": 25,
-                }
-            )
+                # Update conversations with summaries and tags
+                conversations_data_to_insert = zip(
+                    llm_enriched_conversations_df["summary"].tolist(),
+                    llm_enriched_conversations_df["tags"].map(_dumps_json).tolist(),
+                    llm_enriched_conversations_df["conversation_id"].tolist(),
+                )
 
-            def openai_embedding_progress_manager(completed_items: int):
-                # Calculate percentage complete (25-75% range)
-                percent_complete = 25 + (completed_items / n_conversations) * 50
-                # Only call progress_callback when we hit another 10% increment
-                if int(percent_complete / 1) > int(
-                    ((completed_items - 1) / n_conversations * 50) / 1
-                ):
-                    self._update_status_file(
-                        {
-                            "status": "processing",
-                            "message": f"Generating conversation embeddings ({completed_items:,}/{n_conversations:,})",
-                            "progress": int(percent_complete),
-                        }
+                with self.db.savepoint("update_summaries_and_tags"):
+                    cursor = conn.cursor()
+                    cursor.executemany(
+                        """
+                        UPDATE conversations
+                        SET summary = ?, tags = ?
+                        WHERE conversation_id = ?
+                        """,
+                        conversations_data_to_insert,
                     )
 
-            # Generate embeddings
-            embs = self.openai_utils.generate_embeddings_for_texts(
-                text_list=[
-                    f"{row.title}\nTags: {', '.join(row.tags)}\nSummary: {row.summary}\nConversation: {row.messages_markdown[:settings.MAX_CHARS_PER_CONVERSATION_CONTEXT]}"
-                    for row in llm_enriched_conversations_df.itertuples()
-                ],
-                progress_callback=openai_embedding_progress_manager,
-            )
+                # Keep the embeddings as a single contiguous float32 matrix, whose i-th row
+                # belongs to the i-th conversation in llm_enriched_conversations_df
+                embs = np.ascontiguousarray(embs, dtype=np.float32)
 
-            conversation_emb_df = llm_enriched_conversations_df.copy()[
-                ["conversation_id"]
-            ]
-            conversation_emb_df["embedding"] = embs.tolist()
-
-            # Update status as processing progresses
-            self._update_status_file(
-                {
-                    "status": "processing",
-                    "message": "Clustering conversations",
-                    "progress": 50,
-                }
-            )
-
-            # Generate UMAP projections
-            umap_model = self.umap(n_components=2)
-            conversation_emb_df[["umap_x", "umap_y"]] = umap_model.fit_transform(
-                np.stack(conversation_emb_df.embedding)
-            )
+                # L2-normalize the embeddings once up front, so that clustering and the cluster
+                # metrics can treat cosine similarity as a dot product
+                embs /= np.maximum(
+                    np.linalg.norm(embs, axis=1, keepdims=True),
+                    np.finfo(np.float32).tiny,
+                )
 
-            # Update conversations with embeddings and UMAP coordinates
-            conversations_data_to_insert = [
-                {
-                    "conversation_id": row.conversation_id,
-                    "embedding": np.array(row.embedding, dtype=np.float32).tobytes(),
-                    "umap_x": row.umap_x,
-                    "umap_y": row.umap_y,
-                }
-                for row in conversation_emb_df.itertuples()
-            ]
-
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    """
-                    UPDATE conversations
-                    SET embedding = :embedding, umap_x = :umap_x, umap_y = :umap_y
-                    WHERE conversation_id = :conversation_id
-                    """,
-                    conversations_data_to_insert,
+                # UMAP and the clustering run on these (unit-length) float32 vectors; only the
+                # copy that's persisted is quantized to int8 (see append_conversation_embeddings)
+                conversation_ids = llm_enriched_conversations_df[
+                    "conversation_id"
+                ].tolist()
+
+                # Update status as processing progresses
+                self._update_status_file(
+                    {
+                        "status": "processing",
+                        "message": "Clustering conversations",
+                        "progress": 50,
+                    }
                 )
 
-            # Generate clusters
-            n_clusters = min(math.ceil(math.sqrt(len(conversation_emb_df))), 24)
+                # Generate UMAP projections
+                umap_model = self.umap(n_components=2)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    umap_coords = umap_model.fit_transform(embs).tolist()
+
+                # Write the embeddings to the sidecar file in one go, and update the conversations
+                # with their row offsets into it and their UMAP coordinates
+                with self.db.savepoint("update_embeddings"):
+                    start_row = self.db.append_conversation_embeddings(embs)
+                    conversations_data_to_insert = [
+                        (start_row + i, umap_x, umap_y, conversation_id)
+                        for i, (conversation_id, (umap_x, umap_y)) in enumerate(
+                            zip(conversation_ids, umap_coords)
+                        )
+                    ]
+
+                    cursor = conn.cursor()
+                    cursor.executemany(
+                        """
+                        UPDATE conversations
+                        SET emb_row = ?, umap_x = ?, umap_y = ?
+                        WHERE conversation_id = ?
+                        """,
+                        conversations_data_to_insert,
+                    )
 
-            clusters_df = self.cluster_utils.cluster_conversations(
-                conversation_embs_df=conversation_emb_df.merge(
-                    llm_enriched_conversations_df[["conversation_id", "tags"]],
-                    on="conversation_id",
-                ),
-                n_clusters=n_clusters,
-            )
+                # Generate clusters; the clustering utilities work on the embedding matrix (and on
+                # arrays aligned with it by position), so the embeddings never go into a DataFrame
+                n_clusters = min(math.ceil(math.sqrt(len(conversation_ids))), 24)
 
-            cluster_metrics_df = self.cluster_utils.calculate_cluster_metrics(
-                clusters_df
-            )
+                cluster_ids = self.cluster_utils.cluster_embeddings(embs, n_clusters)
 
-            cluster_metrics_df[["umap_x", "umap_y"]] = umap_model.fit_transform(
-                np.stack(cluster_metrics_df.embedding_centroid)
-            )
+                cluster_metrics_df = (
+                    self.cluster_utils.calculate_cluster_metrics_from_arrays(
+                        conversation_ids=conversation_ids,
+                        embeddings=embs,
+                        cluster_ids=cluster_ids,
+                        conversation_tags=llm_enriched_conversations_df[
+                            "tags"
+                        ].tolist(),
+                    )
+                )
 
-            # Update status as processing progresses
-            self._update_status_file(
-                {
-                    "status": "processing",
-                    "message": "Labeling clusters",
-                    "progress": 75,
-                }
-            )
+                # Project the centroids with the already-fitted UMAP model, so they land in the
+                # same 2D space as the conversations they summarize (and we avoid a second fit)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    cluster_metrics_df[["umap_x", "umap_y"]] = umap_model.transform(
+                        np.stack(cluster_metrics_df.embedding_centroid).astype(
+                            np.float32
+                        )
+                    )
 
-            def llm_cluster_enrichment_progress_manager(completed_items: int):
-                # Calculate percentage complete (75-100% range)
-                percent_complete = 75 + (completed_items / n_clusters) * 25
-                # Only call progress_callback when we hit another 10% increment
-                if int(percent_complete / 1) > int(
-                    ((completed_items - 1) / n_clusters * 25) / 1
-                ):
+                # Update status as processing progresses
+                self._update_status_file(
+                    {
+                        "status": "processing",
+                        "message": "Labeling clusters",
+                        "progress": 75,
+                    }
+                )
+
+                def llm_cluster_enrichment_progress_manager(completed_items: int):
+                    # Calculate percentage complete (75-100% range)
+                    percent_complete = 75 + (completed_items / n_clusters) * 25
+                    # Status writes are throttled (except for the last item), since this is
+                    # called for every completed item
                     self._update_status_file(
                         {
                             "status": "processing",
                             "message": f"Labeling clusters ({completed_items:,}/{n_clusters:,})",
                             "progress": int(percent_complete),
-                        }
+                        },
+                        final=completed_items >= n_clusters,
                     )
 
-            # Label clusters using LLM
-            labeled_clusters_df = self.llm_utils.label_conversation_clusters(
-                conversations_df=llm_enriched_conversations_df,
-                cluster_metrics_df=cluster_metrics_df,
-                progress_callback=llm_cluster_enrichment_progress_manager,
-            )
-
-            # Insert cluster data
-            clusters_data_to_insert = [
-                {
-                    "cluster_solution_id": f"kmeans_{n_clusters}",
-                    "cluster_id": row.cluster,
-                    "conversation_ids": json.dumps(row.all_conversation_ids),
-                    "centroid_conversation_ids": json.dumps(
-                        row.centroid_conversation_ids
-                    ),
-                    "centroid_embedding": np.array(
-                        row.embedding_centroid, dtype=np.float32
-                    ).tobytes(),
-                    "cluster_size": row.n_conversations,
-                    "cluster_label": row.cluster_label,
-                    "cluster_description": row.cluster_description,
-                    "tag_counts": json.dumps(row.tag_counts),
-                    "mean_cosine_similarity": row.mean_cosine_similarity,
-                    "cluster_radius": row.cluster_radius,
-                    "silhouette_score": row.silhouette_score,
-                    "centroid_umap_x": row.umap_x,
-                    "centroid_umap_y": row.umap_y,
-                }
-                for row in labeled_clusters_df.itertuples()
-            ]
-
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    """
-                    INSERT INTO clusters (
-                        cluster_solution_id,
-                        cluster_id,
-                        conversation_ids,
-                        centroid_conversation_ids,
-                        centroid_embedding,
-                        cluster_size,
-                        cluster_label,
-                        cluster_description,
-                        tag_counts,
-                        mean_cosine_similarity,
-                        cluster_radius,
-                        silhouette_score,
-                        centroid_umap_x,
-                        centroid_umap_y
-                    ) VALUES (
-                        :cluster_solution_id,
-                        :cluster_id,
-                        :conversation_ids,
-                        :centroid_conversation_ids,
-                        :centroid_embedding,
-                        :cluster_size,
-                        :cluster_label,
-                        :cluster_description,
-                        :tag_counts,
-                        :mean_cosine_similarity,
-                        :cluster_radius,
-                        :silhouette_score,
-                        :centroid_umap_x,
-                        :centroid_umap_y
+                # Label clusters using LLM
+                labeled_clusters_df = run_openai_coroutine(
+                    self.llm_utils.label_conversation_clusters_async(
+                        conversations_df=llm_enriched_conversations_df,
+                        cluster_metrics_df=cluster_metrics_df,
+                        progress_callback=llm_cluster_enrichment_progress_manager,
+                        openai_client=openai_client,
+                        rate_limit_budget=rate_limit_budget,
                     )
-                    """,
-                    clusters_data_to_insert,
                 )
 
+                # Insert cluster data, with the centroid embeddings stored in their own sidecar file
+                n_labeled_clusters = len(labeled_clusters_df)
+                with self.db.savepoint("insert_clusters"):
+                    centroid_start_row = self.db.append_centroid_embeddings(
+                        np.stack(labeled_clusters_df["embedding_centroid"])
+                    )
+                    clusters_data_to_insert = zip(
+                        [f"kmeans_{n_clusters}"] * n_labeled_clusters,
+                        labeled_clusters_df["cluster"].tolist(),
+                        labeled_clusters_df["all_conversation_ids"]
+                        .map(_dumps_json)
+                        .tolist(),
+                        labeled_clusters_df["centroid_conversation_ids"]
+                        .map(_dumps_json)
+                        .tolist(),
+                        range(
+                            centroid_start_row, centroid_start_row + n_labeled_clusters
+                        ),
+                        labeled_clusters_df["n_conversations"].tolist(),
+                        labeled_clusters_df["cluster_label"].tolist(),
+                        labeled_clusters_df["cluster_description"].tolist(),
+                        labeled_clusters_df["tag_counts"].map(_dumps_json).tolist(),
+                        labeled_clusters_df["mean_cosine_similarity"].tolist(),
+                        labeled_clusters_df["cluster_radius"].tolist(),
+                        labeled_clusters_df["silhouette_score"].tolist(),
+                        labeled_clusters_df["umap_x"].tolist(),
+                        labeled_clusters_df["umap_y"].tolist(),
+                    )
+
+                    self.db.bulk_insert(
+                        conn, "clusters", CLUSTER_COLUMNS, clusters_data_to_insert
+                    )
+
             # Update status as processing completes
             self._update_status_file(
                 {
@@ -419,4 +580,54 @@ class ProcessingService:
             self._update_status_file(
                 {"status": "error", "message": str(e), "progress": 0}
             )
-            logger.error(f"Processing error: {str(e)}")
+            logger.exception("Processing error: %s", e)
+
+
+# ===============
+# PROCESSING JOBS
+# ===============
+# Uploads are processed in a separate worker process (see main.py), so the CPU-heavy stages
+# (UMAP, clustering, pandas work) don't compete with the API's request handlers for the GIL.
+
+
+def warm_up_processing_worker():
+    """
+    Fit (and apply) a tiny UMAP model, so numba compiles UMAP's kernels before the first upload
+    arrives, rather than in the middle of processing it. This is meant to be submitted to the
+    worker process once at startup.
+    """
+    UMAP = _import_umap_class()
+
+    warm_up_embs = np.random.default_rng(0).random((32, 8), dtype=np.float32)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        umap_model = UMAP(n_components=2)
+        umap_model.fit_transform(warm_up_embs)
+        umap_model.transform(warm_up_embs[:4])
+
+
+def run_processing_job(db_path: str, conversations_path: str):
+    """
+    Process an uploaded export from within a worker process. Progress is reported through
+    the shared status file, which the API process reads from.
+
+    Args:
+        db_path (str): Path to the SQLite database to store the results in
+        conversations_path (str): Path to the uploaded conversations.json export. The file
+            is deleted once processing finishes.
+    """
+    processor = ProcessingService(DatabaseManager(db_path), reset_status=False)
+    try:
+        # The file stays open until processing is done (even if it fails part-way), since
+        # larger exports are streamed from it
+        with open(conversations_path, "rb") as f:
+            # Small exports are parsed in one shot; larger ones are streamed from disk, so we
+            # never hold both the raw bytes and the parsed list in memory
+            if os.path.getsize(conversations_path) <= settings.MAX_IN_MEMORY_UPLOAD_BYTES:
+                conversations = orjson.loads(f.read())
+            else:
+                conversations = data_utils.iter_conversations(f)
+            processor.process_conversations(conversations)
+    finally:
+        processor.db.close()
+        os.unlink(conversations_path)
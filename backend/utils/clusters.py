@@ -9,12 +9,12 @@ This module contains various utility functions used for clustering the data.
 
 # General imports
 from collections import Counter
+from typing import List, Sequence
 
 # Third-party imports
 import pandas as pd
 import numpy as np
 from sklearn.cluster import MiniBatchKMeans
-from sklearn.metrics import silhouette_samples
 
 # ================
 # DEFINING METHODS
@@ -22,35 +22,92 @@ from sklearn.metrics import silhouette_samples
 # Next, we'll define the methods we'll use to cluster the data
 
 
-def cluster_conversations(conversation_embs_df: pd.DataFrame, n_clusters: int = 24):
+def _fit_cluster_labels(embeddings_array: np.ndarray, n_clusters: int) -> np.ndarray:
     """
-    Cluster conversations using MiniBatchKMeans and add cluster labels to DataFrame.
+    Fit KMeans to the embeddings and return the cluster label of each one. This uses faiss
+    (whose assignment step is SIMD / OpenMP-accelerated) when it's installed, and falls back
+    to scikit-learn's MiniBatchKMeans otherwise.
 
     Args:
-        conversation_embs_df (pd.DataFrame): DataFrame containing conversation_id and embedding columns
+        embeddings_array (np.ndarray): A 2D array of embeddings, one per row
         n_clusters (int): Number of clusters to generate
 
     Returns:
-        pd.DataFrame: Copy of input DataFrame with added 'cluster' column containing string cluster IDs
+        np.ndarray: The integer cluster label of each embedding
     """
+    try:
+        import faiss
+    except ImportError:
+        minibatch_kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+        )
+        return minibatch_kmeans.fit_predict(embeddings_array)
 
-    # Convert embeddings from object to numpy array
-    embeddings_array = np.stack(conversation_embs_df["embedding"].values)
+    # faiss only works with contiguous float32 arrays. We L2-normalize a copy so that the
+    # L2 distances faiss uses for assignment rank points the same way cosine similarity does
+    embeddings_array = np.array(
+        embeddings_array, dtype=np.float32, order="C", copy=True
+    )
+    faiss.normalize_L2(embeddings_array)
 
-    # Initialize and fit MiniBatchKMeans
-    minibatch_kmeans = MiniBatchKMeans(
-        n_clusters=n_clusters,
+    # Exports are often small relative to the number of clusters, so we don't want faiss
+    # warning about there being too few points per centroid
+    kmeans = faiss.Kmeans(
+        d=embeddings_array.shape[1],
+        k=n_clusters,
+        niter=25,
+        nredo=1,
+        verbose=False,
+        gpu=False,
+        min_points_per_centroid=1,
     )
-    cluster_labels = minibatch_kmeans.fit_predict(embeddings_array)
+    kmeans.train(embeddings_array)
+    _, cluster_labels = kmeans.index.search(embeddings_array, 1)
+    return cluster_labels.ravel()
+
+
+def cluster_embeddings(embeddings: np.ndarray, n_clusters: int = 24) -> np.ndarray:
+    """
+    Cluster a matrix of embeddings using KMeans.
+
+    Args:
+        embeddings (np.ndarray): A 2D array of embeddings, one per row
+        n_clusters (int): Number of clusters to generate
+
+    Returns:
+        np.ndarray: The zero-padded string cluster ID (e.g. "cluster_07") of each embedding
+    """
+
+    # Fit KMeans and get the cluster labels
+    cluster_labels = _fit_cluster_labels(embeddings, n_clusters)
 
     # Calculate number of digits needed for zero padding based on n_clusters
     n_digits = len(str(n_clusters - 1))
 
+    # Format the labels as zero-padded string cluster IDs
+    return np.array(
+        [f"cluster_{str(label).zfill(n_digits)}" for label in cluster_labels]
+    )
+
+
+def cluster_conversations(conversation_embs_df: pd.DataFrame, n_clusters: int = 24):
+    """
+    Cluster conversations using KMeans and add cluster labels to DataFrame.
+
+    Args:
+        conversation_embs_df (pd.DataFrame): DataFrame containing conversation_id and embedding columns
+        n_clusters (int): Number of clusters to generate
+
+    Returns:
+        pd.DataFrame: Copy of input DataFrame with added 'cluster' column containing string cluster IDs
+    """
+
+    # Convert embeddings from object to numpy array
+    embeddings_array = np.stack(conversation_embs_df["embedding"].values)
+
     # Create copy of DataFrame and add zero-padded string cluster labels
     result_df = conversation_embs_df.copy()
-    result_df["cluster"] = [
-        f"cluster_{str(label).zfill(n_digits)}" for label in cluster_labels
-    ]
+    result_df["cluster"] = cluster_embeddings(embeddings_array, n_clusters)
 
     # Sort according to cluster
     result_df = result_df.sort_values(by="cluster")
@@ -58,10 +115,100 @@ def cluster_conversations(conversation_embs_df: pd.DataFrame, n_clusters: int =
     return result_df
 
 
+def _sampled_cluster_silhouettes(
+    embeddings: np.ndarray,
+    label_ints: np.ndarray,
+    sample_size: int = 256,
+    random_state: int = 0,
+    sq_norms: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Estimates the mean silhouette score of each cluster from a sample of up to `sample_size`
+    points per cluster, rather than from the full O(N^2) pairwise distance matrix. Clusters
+    with at most `sample_size` points are used in full, so when every cluster is that small,
+    this matches the per-cluster mean of sklearn's (euclidean) silhouette_samples.
+
+    Args:
+        embeddings (np.ndarray): A 2D array of embeddings, one per row
+        label_ints (np.ndarray): The integer cluster label (0 to n_clusters - 1) of each embedding
+        sample_size (int): The maximum number of points to sample from each cluster
+        random_state (int): Seed for the random sampling
+        sq_norms (np.ndarray, optional): The squared L2 norm of each embedding, if already computed
+
+    Returns:
+        np.ndarray: The estimated mean silhouette score of each cluster
+    """
+    n_clusters = label_ints.max() + 1
+    if n_clusters < 2:
+        return np.zeros(n_clusters)
+
+    # Sample points from each cluster; the samples are laid out contiguously, cluster by cluster
+    rng = np.random.default_rng(random_state)
+    sample_indices = []
+    for cluster_idx in range(n_clusters):
+        cluster_indices = np.flatnonzero(label_ints == cluster_idx)
+        if len(cluster_indices) > sample_size:
+            cluster_indices = rng.choice(cluster_indices, sample_size, replace=False)
+        sample_indices.append(cluster_indices)
+    sample_counts = np.array([len(indices) for indices in sample_indices])
+    sample_starts = np.concatenate([[0], np.cumsum(sample_counts)[:-1]])
+    sample_indices = np.concatenate(sample_indices)
+    samples = np.ascontiguousarray(embeddings[sample_indices], dtype=np.float32)
+    if sq_norms is None:
+        sample_sq_norms = np.einsum("ij,ij->i", samples, samples)
+    else:
+        sample_sq_norms = np.asarray(sq_norms[sample_indices], dtype=np.float32)
+
+    # One-hot (sampled point x cluster) membership matrix, so summing distances per cluster
+    # is also a matrix product
+    sample_membership = np.repeat(
+        np.eye(n_clusters, dtype=np.float32), sample_counts, axis=0
+    )
+
+    cluster_silhouettes = np.zeros(n_clusters)
+    for cluster_idx in range(n_clusters):
+        cluster_slice = slice(
+            sample_starts[cluster_idx],
+            sample_starts[cluster_idx] + sample_counts[cluster_idx],
+        )
+
+        # A silhouette score of 0 is used for singleton clusters (as sklearn does)
+        if sample_counts[cluster_idx] < 2:
+            continue
+
+        # Euclidean distances between this cluster's sampled points and every sampled point,
+        # as a single matrix product
+        sq_distances = (
+            sample_sq_norms[cluster_slice, None]
+            + sample_sq_norms[None, :]
+            - 2 * (samples[cluster_slice] @ samples.T)
+        )
+        distances = np.sqrt(np.maximum(sq_distances, 0))
+
+        # Mean distance from each point to each cluster's sample
+        mean_distances = (distances @ sample_membership).astype(
+            np.float64
+        ) / sample_counts[None, :]
+
+        # a: mean distance to the rest of its own cluster (its distance to itself is 0)
+        own_counts = sample_counts[cluster_idx]
+        a = mean_distances[:, cluster_idx] * own_counts / (own_counts - 1)
+
+        # b: mean distance to the nearest other cluster
+        mean_distances[:, cluster_idx] = np.inf
+        b = mean_distances.min(axis=1)
+
+        silhouettes = (b - a) / np.maximum(np.maximum(a, b), np.finfo(float).tiny)
+        cluster_silhouettes[cluster_idx] = silhouettes.mean()
+
+    return cluster_silhouettes
+
+
 def calculate_cluster_metrics(
     cluster_df: pd.DataFrame,
     n_centroid_docs: int = 8,
     max_n_tags_per_cluster: int = 15,
+    silhouette_sample_size: int = 256,
 ):
     """
     Calculates metrics for each cluster including centroid conversations, tag counts, similarities and quality metrics.
@@ -71,6 +218,43 @@ def calculate_cluster_metrics(
             "conversation_id", "embedding", "cluster", "tags"
         n_centroid_docs (int): Number of centroid documents to find per cluster
         max_n_tags_per_cluster (int): Maximum number of tags to store per cluster
+        silhouette_sample_size (int): Maximum number of points per cluster to estimate silhouette scores from
+
+    Returns:
+        pd.DataFrame: DataFrame of cluster metrics (see calculate_cluster_metrics_from_arrays)
+    """
+    return calculate_cluster_metrics_from_arrays(
+        conversation_ids=cluster_df["conversation_id"].to_numpy(),
+        embeddings=np.stack(cluster_df["embedding"].values),
+        cluster_ids=cluster_df["cluster"].to_numpy(),
+        conversation_tags=cluster_df["tags"].to_numpy(),
+        n_centroid_docs=n_centroid_docs,
+        max_n_tags_per_cluster=max_n_tags_per_cluster,
+        silhouette_sample_size=silhouette_sample_size,
+    )
+
+
+def calculate_cluster_metrics_from_arrays(
+    conversation_ids: Sequence[str],
+    embeddings: np.ndarray,
+    cluster_ids: Sequence[str],
+    conversation_tags: Sequence[List[str]],
+    n_centroid_docs: int = 8,
+    max_n_tags_per_cluster: int = 15,
+    silhouette_sample_size: int = 256,
+):
+    """
+    Calculates metrics for each cluster including centroid conversations, tag counts, similarities and quality metrics.
+    All of the arrays are aligned by position, with one entry (or row) per conversation.
+
+    Args:
+        conversation_ids (Sequence[str]): The ID of each conversation
+        embeddings (np.ndarray): A 2D array with the embedding of each conversation
+        cluster_ids (Sequence[str]): The cluster ID of each conversation (e.g. from cluster_embeddings)
+        conversation_tags (Sequence[List[str]]): The list of tags of each conversation
+        n_centroid_docs (int): Number of centroid documents to find per cluster
+        max_n_tags_per_cluster (int): Maximum number of tags to store per cluster
+        silhouette_sample_size (int): Maximum number of points per cluster to estimate silhouette scores from
 
     Returns:
         pd.DataFrame: DataFrame containing cluster metrics including:
@@ -85,51 +269,92 @@ def calculate_cluster_metrics(
             - silhouette_score: Silhouette score for the cluster
     """
 
-    # Convert embeddings to numpy array
-    embeddings = np.stack(cluster_df["embedding"].values)
+    # All of the similarity math runs in float32 (a no-op for the pipelines, whose embeddings
+    # already are), which halves the memory traffic and doubles the SIMD width of the BLAS calls
+    embeddings = np.asarray(embeddings, dtype=np.float32)
 
-    # Calculate silhouette scores for all points
-    silhouette_scores = silhouette_samples(embeddings, cluster_df["cluster"])
+    # Map each cluster ID to an integer label, and count the conversations in each cluster
+    cluster_ids, label_ints = np.unique(cluster_ids, return_inverse=True)
+    n_points = len(label_ints)
+    counts = np.bincount(label_ints)
 
-    # Initialize results list
-    cluster_metrics = []
+    # Calculate centroids, as a single (one-hot membership matrix @ embeddings) product
+    membership = (label_ints[None, :] == np.arange(len(cluster_ids))[:, None]).astype(
+        embeddings.dtype
+    )
+    centroids = ((membership @ embeddings) / counts[:, None]).astype(embeddings.dtype)
 
-    # Calculate metrics for each cluster
-    for cluster_id in cluster_df["cluster"].unique():
-        # Get cluster data
-        cluster_mask = cluster_df["cluster"] == cluster_id
-        cluster_embeddings = embeddings[cluster_mask]
-        cluster_conversations = cluster_df[cluster_mask]
+    # Dot product of each point with its own centroid, which gives us both the cosine
+    # similarities and the euclidean distances without materializing (embeddings - centroid).
+    # The point norms are computed once here, and reused for the silhouette estimates (for
+    # L2-normalized embeddings, they're all 1)
+    point_centroid_dots = (embeddings @ centroids.T)[np.arange(n_points), label_ints]
+    point_sq_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+    centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)[label_ints]
 
-        # Calculate centroid
-        centroid = np.mean(cluster_embeddings, axis=0)
+    # Calculate cosine similarities to centroid
+    norm_products = np.sqrt(point_sq_norms * centroid_sq_norms)
+    similarities = point_centroid_dots / np.where(norm_products == 0, 1, norm_products)
 
-        # Calculate cosine similarities to centroid
-        similarities = np.dot(cluster_embeddings, centroid) / (
-            np.linalg.norm(cluster_embeddings, axis=1) * np.linalg.norm(centroid)
-        )
-        mean_similarity = float(np.mean(similarities))
+    # Calculate distances to centroid
+    distances = np.sqrt(
+        np.maximum(point_sq_norms - 2 * point_centroid_dots + centroid_sq_norms, 0)
+    )
+
+    # Sort the per-point values by cluster (stably, so conversations keep their order within
+    # each cluster); every cluster is then a contiguous slice, so the per-cluster aggregates
+    # are segmented reductions over those slices
+    order = np.argsort(label_ints, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    similarities = similarities[order]
+    conversation_ids = np.asarray(conversation_ids)[order]
+    conversation_tags = [conversation_tags[i] for i in order]
+
+    mean_similarities = np.add.reduceat(similarities, starts, dtype=np.float64) / counts
+    cluster_radii = np.maximum.reduceat(distances[order], starts)
+
+    # Calculate (an estimate of) the mean silhouette score of each cluster
+    cluster_silhouettes = _sampled_cluster_silhouettes(
+        embeddings,
+        label_ints,
+        sample_size=silhouette_sample_size,
+        sq_norms=point_sq_norms,
+    )
 
-        # Calculate cluster radius (max distance from centroid)
-        distances = np.linalg.norm(cluster_embeddings - centroid, axis=1)
-        cluster_radius = float(np.max(distances))
+    # Initialize results list
+    cluster_metrics = []
 
-        # Get centroid documents (closest to centroid)
+    # Assemble the metrics for each cluster
+    for cluster_idx, cluster_id in enumerate(cluster_ids):
+        cluster_slice = slice(
+            starts[cluster_idx], starts[cluster_idx] + counts[cluster_idx]
+        )
+        cluster_similarities = similarities[cluster_slice]
+
+        # Get centroid documents (closest to centroid), ordered by increasing similarity
         # TODO: I should experiment w/ alternative ways of selecting centroid documents
-        centroid_indices = np.argsort(similarities)[-n_centroid_docs:]
-        centroid_conversation_ids = cluster_conversations.iloc[centroid_indices][
-            "conversation_id"
+        if len(cluster_similarities) > n_centroid_docs:
+            centroid_indices = np.argpartition(cluster_similarities, -n_centroid_docs)[
+                -n_centroid_docs:
+            ]
+        else:
+            centroid_indices = np.arange(len(cluster_similarities))
+        centroid_indices = centroid_indices[
+            np.argsort(cluster_similarities[centroid_indices])
+        ]
+        centroid_conversation_ids = conversation_ids[cluster_slice][
+            centroid_indices
         ].tolist()
 
         # Get all conversation IDs
-        all_conversation_ids = cluster_conversations["conversation_id"].tolist()
-
-        # Calculate tag counts using Counter
-        all_tags = [tag for tags in cluster_conversations["tags"] for tag in tags]
-        tag_counts = dict(Counter(all_tags).most_common(max_n_tags_per_cluster))
+        all_conversation_ids = conversation_ids[cluster_slice].tolist()
 
-        # Calculate mean silhouette score for this cluster
-        cluster_silhouette = float(np.mean(silhouette_scores[cluster_mask]))
+        # Calculate tag counts, updating a Counter with each conversation's tags in turn
+        # (rather than flattening all of the cluster's tags into a temporary list first)
+        cluster_tag_counter = Counter()
+        for tags in conversation_tags[cluster_slice]:
+            cluster_tag_counter.update(tags or [])
+        tag_counts = dict(cluster_tag_counter.most_common(max_n_tags_per_cluster))
 
         # Store metrics
         cluster_metrics.append(
@@ -138,11 +363,11 @@ def calculate_cluster_metrics(
                 "centroid_conversation_ids": centroid_conversation_ids,
                 "all_conversation_ids": all_conversation_ids,
                 "n_conversations": len(all_conversation_ids),
-                "embedding_centroid": centroid,
+                "embedding_centroid": centroids[cluster_idx],
                 "tag_counts": tag_counts,
-                "mean_cosine_similarity": mean_similarity,
-                "cluster_radius": cluster_radius,
-                "silhouette_score": cluster_silhouette,
+                "mean_cosine_similarity": float(mean_similarities[cluster_idx]),
+                "cluster_radius": float(cluster_radii[cluster_idx]),
+                "silhouette_score": float(cluster_silhouettes[cluster_idx]),
             }
         )
 
@@ -7,7 +7,11 @@ This module contains various utility functions related to parsing the ChatGPT ex
 # =====
 # Below, we'll set up the rest of the file.
 
+# General imports
+from typing import IO, Iterator, List
+
 # Third-party imports
+import ijson
 import pandas as pd
 
 # ================
@@ -16,7 +20,25 @@ import pandas as pd
 # Next, we'll define the utility functions that we'll use to parse the ChatGPT export data.
 
 
-def extract_longest_conversation_df(mapping: dict) -> pd.DataFrame:
+def iter_conversations(conversations_file: IO[bytes]) -> Iterator[dict]:
+    """
+    Lazily yields the conversations contained in a `conversations.json` export, without
+    loading the whole file into memory. The file is closed once it has been exhausted.
+
+    Args:
+        conversations_file (IO[bytes]): A binary file object positioned at the start of the export.
+
+    Returns:
+        Iterator[dict]: An iterator over the conversation dictionaries in the export.
+    """
+    try:
+        # use_float keeps timestamps as floats (rather than Decimals) so they can be bound by sqlite3
+        yield from ijson.items(conversations_file, "item", use_float=True)
+    finally:
+        conversations_file.close()
+
+
+def extract_longest_conversation_messages(mapping: dict) -> List[dict]:
     """
     Extracts the longest "chain" of messages from a mapping of conversation nodes.
 
@@ -24,14 +46,19 @@ def extract_longest_conversation_df(mapping: dict) -> pd.DataFrame:
         mapping (dict): A dictionary mapping node IDs to node information.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the messages in the longest chain.
+        List[dict]: The messages in the longest chain, sorted by creation time. Each message
+            also has an "author_role" key, pulled out of its "author" field.
     """
 
-    # Helper function to get chain from node to leaf
-    def get_chain_from_node(node_id):
+    # Walk down the first-child chain from each root node (nodes with no parent) in a
+    # single pass, keeping only the longest chain of non-null messages
+    longest_chain = []
+    for node_id, node in mapping.items():
+        if node["parent"] is not None:
+            continue
+
         chain = []
         current_id = node_id
-
         while current_id:
             node = mapping[current_id]
             if node["message"] is not None:  # Only include non-null messages
@@ -41,84 +68,89 @@ def extract_longest_conversation_df(mapping: dict) -> pd.DataFrame:
             children = node["children"]
             current_id = children[0] if children else None
 
-        return chain
+        if len(chain) > len(longest_chain):
+            longest_chain = chain
 
-    # Find all root nodes (nodes with no parent)
-    root_nodes = [
-        node_id for node_id, node in mapping.items() if node["parent"] is None
+    # The chain order almost always matches the creation order already, so we only pay
+    # for a sort when it doesn't
+    create_times = [message["create_time"] or 0 for message in longest_chain]
+    if any(later < earlier for earlier, later in zip(create_times, create_times[1:])):
+        longest_chain = sorted(longest_chain, key=lambda x: x["create_time"] or 0)
+
+    # Add the "author_role" to each of the messages
+    return [
+        dict(
+            message,
+            author_role=message["author"]["role"] if message["author"] else None,
+        )
+        for message in longest_chain
     ]
 
-    # Get all possible chains starting from root nodes
-    all_chains = [get_chain_from_node(root_id) for root_id in root_nodes]
 
-    # Get the longest chain
-    longest_chain = max(all_chains, key=len) if all_chains else []
+def extract_longest_conversation_df(mapping: dict) -> pd.DataFrame:
+    """
+    Extracts the longest "chain" of messages from a mapping of conversation nodes.
 
-    # Create a DataFrame from the mapping
-    messages_df = pd.DataFrame(
-        sorted(
-            longest_chain,
-            key=lambda x: (x["create_time"] or 0) if x else 0,
-        )
-    )
+    Args:
+        mapping (dict): A dictionary mapping node IDs to node information.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing the messages in the longest chain.
+    """
+    return pd.DataFrame(extract_longest_conversation_messages(mapping))
 
-    # Add the "author_role" column
-    messages_df["author_role"] = messages_df["author"].apply(
-        lambda x: x["role"] if x else None
-    )
 
-    # Return the DataFrame
-    return messages_df
+# A mapping from a message's content type to a function extracting its text
+CONTENT_TEXT_EXTRACTORS = {
+    "text": lambda content: " ".join(content.get("parts", [])),
+    "code": lambda content: content.get("text", None),
+    "multimodal_text": lambda content: " ".join(
+        part if isinstance(part, str) else "\n[IMAGE OMITTED]\n"
+        for part in content.get("parts", [])
+    ),
+}
 
 
 def extract_simple_conversation_markdown(
-    conversation_df: pd.DataFrame = None, mapping: dict = None
+    conversation_df: pd.DataFrame = None,
+    mapping: dict = None,
+    messages: List[dict] = None,
 ) -> str:
     """
     Extracts a simple Markdown representation of a conversation between a user and an AI assistant.
-    The output of the `extract_longest_conversation_df` function can be used as input to this function.
+    The output of the `extract_longest_conversation_messages` (or `extract_longest_conversation_df`)
+    function can be used as input to this function.
 
     Args:
-        conversation_df (pd.DataFrame, optional): A DataFrame containing the conversation data. If not provided, mapping must be provided.
-        mapping (dict, optional): A dictionary mapping node IDs to node information. If provided, will be used to extract conversation DataFrame.
+        conversation_df (pd.DataFrame, optional): A DataFrame containing the conversation data.
+        mapping (dict, optional): A dictionary mapping node IDs to node information. If provided, will be used to extract the conversation's messages.
+        messages (List[dict], optional): A list of the conversation's messages. One of conversation_df, mapping or messages must be provided.
 
     Returns:
         str: A simple Markdown representation of the conversation
     """
     if mapping is not None:
-        conversation_df = extract_longest_conversation_df(mapping)
-    elif conversation_df is None:
-        raise ValueError("Either conversation_df or mapping must be provided")
-
-    # Filter out messages not from the assistant / user
-    filtered_conversation_df = conversation_df.query(
-        "author_role=='assistant' | author_role=='user'"
-    )
+        messages = extract_longest_conversation_messages(mapping)
+    elif conversation_df is not None:
+        messages = conversation_df.to_dict(orient="records")
+    elif messages is None:
+        raise ValueError("Either conversation_df, mapping or messages must be provided")
 
-    # Iterate through each of the message data within the filtered_conversation_df, and extract the content
+    # Iterate through each of the messages from the assistant / user, and extract the content
     markdown_lines = []
-    for msg_row in filtered_conversation_df.itertuples():
+    for message in messages:
 
-        # Extract a dictionary of the message data + message content
-        msg_data_dict = msg_row._asdict()
-        msg_content_dict = msg_data_dict.get("content", {})
+        # Determine the role of the author, skipping messages not from the assistant / user
+        author_role = message.get("author_role")
+        if author_role not in ("assistant", "user"):
+            continue
 
-        # Determine the role of the author
-        author_role = msg_data_dict.get("author_role")
+        # Extract the message content
+        msg_content_dict = message.get("content") or {}
 
         # Populate the msg_text depending on the content type
-        msg_text = None
-        if msg_content_dict.get("content_type") == "text":
-            msg_text = " ".join(msg_content_dict.get("parts", []))
-        elif msg_content_dict.get("content_type") == "code":
-            msg_text = msg_content_dict.get("text", None)
-        elif msg_content_dict.get("content_type") == "multimodal_text":
-            msg_text = " ".join(
-                [
-                    part if isinstance(part, str) else "\n[IMAGE OMITTED]\n"
-                    for part in msg_content_dict.get("parts", [])
-                ]
-            )
+        extract_text = CONTENT_TEXT_EXTRACTORS.get(msg_content_dict.get("content_type"))
+        msg_text = extract_text(msg_content_dict) if extract_text else None
 
         # If the message text is not None, add it to the markdown_lines list
         if msg_text is not None and msg_text.strip() != "":
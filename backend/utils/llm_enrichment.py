@@ -8,12 +8,24 @@ This module contains various utility functions related to using LLMs for enrichi
 # Below, we'll set up the rest of the file.
 
 # General imports
+import asyncio
 import logging
-import json
-from typing import List, Optional, Callable
+from typing import (
+    Any,
+    Awaitable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Callable,
+    Tuple,
+    Union,
+)
 
 # Third-party imports
+import orjson
 import pandas as pd
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
@@ -24,47 +36,76 @@ import utils.settings as settings
 # Set up the logger
 logger = logging.getLogger(__name__)
 
+# The conversation fields that enrich_conversations_with_summaries_and_tags keeps when it's
+# passed records instead of a DataFrame
+CONVERSATION_ENRICHMENT_COLUMNS = ["conversation_id", "title", "messages_markdown"]
+
 # ================
 # DEFINING METHODS
 # ================
 # Next, we'll define the utility functions that we'll use to enrich the data.
 
 
-def enrich_conversations_with_summaries_and_tags(
-    conversations_df: pd.DataFrame,
+async def enrich_conversations_with_summaries_and_tags_async(
+    conversations_df: Union[pd.DataFrame, Iterable[Mapping]],
     max_chars_per_conversation_context: int = 4_000,
     n_suggested_tags: tuple[int, int] = (3, 5),
     gpt_model: str = settings.DEFAULT_GPT_MODEL,
     max_parallel_requests: int = settings.MAX_CONCURRENT_OPENAI_REQUESTS,
     show_progress: bool = True,
     progress_callback: Optional[Callable[[int], None]] = None,
+    rows_per_request: int = settings.CONVERSATIONS_PER_ENRICHMENT_REQUEST,
+    openai_client: Optional[AsyncOpenAI] = None,
+    rate_limit_budget: Optional[openai_utils._RateLimitBudget] = None,
 ) -> pd.DataFrame:
     """
     Enriches a conversations DataFrame with LLM-generated summaries and tags.
 
     Args:
-        conversations_df: DataFrame containing conversation data with messages_markdown column
+        conversations_df: DataFrame containing conversation data with messages_markdown column. This can
+            also be an iterable of conversation records, in which case only the CONVERSATION_ENRICHMENT_COLUMNS
+            fields are loaded into the DataFrame.
         max_chars_per_conversation_context: Maximum characters to include in context sent to LLM
         n_suggested_tags: Tuple of (min_tags, max_tags) to generate
         gpt_model: The GPT model to use for generating summaries and tags
         max_parallel_requests: Maximum number of parallel requests to make to the API
         show_progress: Whether to show a progress bar during processing
         progress_callback: Optional callback function to report progress. Callback function should accept an integer representing completed items.
+        rows_per_request: Number of conversations packed into each request. Larger values mean fewer requests
+            (and less prompt overhead), at the cost of longer, more error-prone completions.
+        openai_client: A client to share with other requests (see openai_utils.create_async_openai_client).
+            If it's not provided, one is created for this call.
+        rate_limit_budget: A rate limit budget to share with other requests (see
+            openai_utils.open_openai_session). If it's not provided, one is created for this call.
 
     Returns:
         DataFrame with added summary and tags columns
     """
-    # Define the system prompt for generating summaries and tags
-    system_prompt = f"""
-    You're an intelligent AI assistant who likes responding in JSON. 
-
-    The user will provide you with a conversation between an AI chatbot and a user. 
-    Your task is to briefly - in 1-2 sentences - summarize the main topics covered within the conversation.
-    You'll also provide a list of "tags" - these are keywords / short phrases that characterize the conversation.
-    Tags ought to be lowercase, and relevant to the conversation content. Include between {n_suggested_tags[0]}-{n_suggested_tags[1]} tags.
-    """
+    # Load records into a DataFrame, keeping only the fields we need
+    if not isinstance(conversations_df, pd.DataFrame):
+        conversations_df = pd.DataFrame.from_records(
+            conversations_df, columns=CONVERSATION_ENRICHMENT_COLUMNS
+        )
+
+    rows_per_request = max(rows_per_request, 1)
 
-    # Define Pydantic model for structured output
+    # Define the system prompt for generating summaries and tags. It's kept short, since it's
+    # sent with every request; the response schema already describes each field
+    system_prompt = (
+        "Summarize the user's conversation with an AI chatbot in 1-2 sentences, and list "
+        f"{n_suggested_tags[0]}-{n_suggested_tags[1]} short, lowercase tags (keywords / phrases) characterizing it."
+    )
+
+    # When several conversations are packed into each request, the prompt asks for one
+    # summary per numbered conversation instead
+    if rows_per_request > 1:
+        system_prompt = (
+            "For each numbered conversation between a user and an AI chatbot, write a 1-2 sentence summary "
+            f"and list {n_suggested_tags[0]}-{n_suggested_tags[1]} short, lowercase tags (keywords / phrases) characterizing it. "
+            "Return exactly one item per conversation, with its number."
+        )
+
+    # Define Pydantic models for structured output
     class ConversationSummary(BaseModel):
         summary: str = Field(
             ..., description="A 1-2 sentence summary of the conversation"
@@ -73,8 +114,48 @@ def enrich_conversations_with_summaries_and_tags(
             ..., description="A list of tags that describe the conversation"
         )
 
+    class NumberedConversationSummary(ConversationSummary):
+        conversation_number: int = Field(
+            ..., description="The number of the conversation that this summary is for"
+        )
+
+    class BatchedConversationSummaries(BaseModel):
+        items: List[NumberedConversationSummary] = Field(
+            ..., description="One summary for each of the conversations"
+        )
+
+    # Split the conversations into the groups that are sent together in each request
+    conversation_contexts = (
+        conversations_df["messages_markdown"]
+        .str.slice(0, max_chars_per_conversation_context)
+        .add("...")
+        .tolist()
+    )
+    n_conversations = len(conversation_contexts)
+    context_groups = [
+        conversation_contexts[start : start + rows_per_request]
+        for start in range(0, n_conversations, rows_per_request)
+    ]
+
+    def _format_user_message(context_group: List[str]) -> str:
+        if rows_per_request == 1:
+            return context_group[0]
+        return "\n\n".join(
+            f"### Conversation {conversation_number}\n{context}"
+            for conversation_number, context in enumerate(context_group, start=1)
+        )
+
+    # Report progress in terms of conversations, rather than requests
+    request_progress_callback = None
+    if progress_callback:
+
+        def request_progress_callback(completed_requests: int):
+            progress_callback(
+                min(completed_requests * rows_per_request, n_conversations)
+            )
+
     # Generate completions in parallel
-    completions = openai_utils.generate_completions_in_parallel(
+    completions = await openai_utils.generate_completions_in_parallel_async(
         message_format_pairs=[
             (
                 [
@@ -87,55 +168,199 @@ def enrich_conversations_with_summaries_and_tags(
                         "content": [
                             {
                                 "type": "text",
-                                "text": row.messages_markdown[
-                                    :max_chars_per_conversation_context
-                                ]
-                                + "...",
+                                "text": _format_user_message(context_group),
                             }
                         ],
                     },
                 ],
-                ConversationSummary,
+                (
+                    ConversationSummary
+                    if rows_per_request == 1
+                    else BatchedConversationSummaries
+                ),
             )
-            for row in conversations_df.itertuples()
+            for context_group in context_groups
         ],
         gpt_model=gpt_model,
         max_parallel_requests=max_parallel_requests,
         show_progress=show_progress,
         tqdm_label="Enriching conversations with summaries and tags",
-        progress_callback=progress_callback,
+        progress_callback=request_progress_callback,
+        openai_client=openai_client,
+        rate_limit_budget=rate_limit_budget,
     )
 
-    # Parse completions into summaries and tags
+    # Parse completions into summaries and tags, flattening each request's summaries back out
+    # in the original conversation order. Conversations whose summary is missing get None
     conversation_summaries = []
-    for completion in completions:
+    for completion, context_group in zip(completions, context_groups):
         try:
-            conversation_summaries.append(completion.choices[0].message.parsed)
+            parsed = completion.choices[0].message.parsed
+            if rows_per_request == 1:
+                conversation_summaries.append(parsed)
+                continue
+
+            summaries_by_number = {
+                item.conversation_number: item for item in parsed.items
+            }
+            conversation_summaries.extend(
+                summaries_by_number.get(conversation_number)
+                for conversation_number in range(1, len(context_group) + 1)
+            )
         except Exception as e:
             print(f"Error parsing completion: {e}")
             print(completion)
-            conversation_summaries.append(None)
+            conversation_summaries.extend([None] * len(context_group))
 
     # Update conversations DataFrame with summaries and tags
     conversations_df = conversations_df.copy()
     conversations_df["conversation_summary"] = conversation_summaries
-    conversations_df["summary"] = conversations_df["conversation_summary"].apply(
-        lambda x: x.summary if x else None
+    conversations_df["summary"] = [
+        x.summary if x else None for x in conversation_summaries
+    ]
+    conversations_df["tags"] = [x.tags if x else None for x in conversation_summaries]
+
+    return conversations_df
+
+
+def enrich_conversations_with_summaries_and_tags(
+    conversations_df: Union[pd.DataFrame, Iterable[Mapping]],
+    max_chars_per_conversation_context: int = 4_000,
+    n_suggested_tags: tuple[int, int] = (3, 5),
+    gpt_model: str = settings.DEFAULT_GPT_MODEL,
+    max_parallel_requests: int = settings.MAX_CONCURRENT_OPENAI_REQUESTS,
+    show_progress: bool = True,
+    progress_callback: Optional[Callable[[int], None]] = None,
+    rows_per_request: int = settings.CONVERSATIONS_PER_ENRICHMENT_REQUEST,
+) -> pd.DataFrame:
+    """
+    Synchronous wrapper around `enrich_conversations_with_summaries_and_tags_async` (see it for
+    the arguments). If it's called from a thread that's already running an event loop (e.g. a
+    Jupyter notebook), the coroutine is run on a separate thread instead.
+
+    Returns:
+        DataFrame with added summary and tags columns
+    """
+    return openai_utils._run_coroutine_sync(
+        enrich_conversations_with_summaries_and_tags_async(
+            conversations_df=conversations_df,
+            max_chars_per_conversation_context=max_chars_per_conversation_context,
+            n_suggested_tags=n_suggested_tags,
+            gpt_model=gpt_model,
+            max_parallel_requests=max_parallel_requests,
+            show_progress=show_progress,
+            progress_callback=progress_callback,
+            rows_per_request=rows_per_request,
+        )
     )
-    conversations_df["tags"] = conversations_df["conversation_summary"].apply(
-        lambda x: x.tags if x else None
+
+
+async def enrich_conversations_in_shards_async(
+    conversations_df: Union[pd.DataFrame, Iterable[Mapping]],
+    process_enriched_shard: Callable[[pd.DataFrame], Awaitable[Any]],
+    shard_size: int = settings.ENRICHMENT_SHARD_SIZE,
+    show_progress: bool = True,
+    progress_callback: Optional[Callable[[int], None]] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
+    rate_limit_budget: Optional[openai_utils._RateLimitBudget] = None,
+    **enrichment_kwargs,
+) -> Tuple[pd.DataFrame, List[Any]]:
+    """
+    Enriches conversations with summaries and tags one shard at a time, passing each shard to
+    `process_enriched_shard` (e.g. to embed it) as soon as it's enriched. That follow-up work runs
+    while the next shard's summaries are being generated, so the two stages' requests overlap
+    instead of running one after the other.
+
+    Args:
+        conversations_df: The conversations to enrich (see enrich_conversations_with_summaries_and_tags_async)
+        process_enriched_shard: A coroutine function that's called with each enriched shard, in order
+        shard_size: The number of conversations enriched together in each shard
+        show_progress: Whether to show a progress bar for the enrichment
+        progress_callback: Optional callback function to report progress. Callback function should accept an
+            integer representing the number of conversations enriched so far.
+        openai_client: A client to share with other requests (see openai_utils.create_async_openai_client).
+            If it's not provided, one is created for each shard.
+        rate_limit_budget: A rate limit budget to share with other requests (see
+            openai_utils.open_openai_session). If it's not provided, one is created for this call; either
+            way, every shard's requests are paced by the same budget.
+        **enrichment_kwargs: Any other arguments for enrich_conversations_with_summaries_and_tags_async
+
+    Returns:
+        Tuple[pd.DataFrame, List[Any]]: The enriched conversations, and the result of `process_enriched_shard`
+            for each shard (in shard order)
+    """
+    # Load records into a DataFrame, keeping only the fields we need
+    if not isinstance(conversations_df, pd.DataFrame):
+        conversations_df = pd.DataFrame.from_records(
+            conversations_df, columns=CONVERSATION_ENRICHMENT_COLUMNS
+        )
+
+    shard_size = max(shard_size, 1)
+    n_conversations = len(conversations_df)
+
+    # Every shard is paced by the same budget, so its buckets (and the concurrency it has learned
+    # from rate limit errors) carry over from one shard to the next, rather than starting afresh
+    if rate_limit_budget is None:
+        rate_limit_budget = openai_utils._RateLimitBudget(
+            model=enrichment_kwargs.get("gpt_model", settings.DEFAULT_GPT_MODEL),
+            max_concurrency=enrichment_kwargs.get(
+                "max_parallel_requests", settings.MAX_CONCURRENT_OPENAI_REQUESTS
+            ),
+        )
+
+    progress_bar = tqdm(
+        total=n_conversations,
+        desc="Enriching conversations with summaries and tags",
+        disable=not show_progress,
     )
 
-    return conversations_df
+    # Each shard's follow-up task is started as soon as the shard is enriched; they're only
+    # awaited once every shard has been enriched
+    enriched_shards = []
+    follow_up_tasks = []
+    try:
+        for start in range(0, n_conversations, shard_size):
+
+            def shard_progress_callback(completed_items: int, start: int = start):
+                progress_bar.update(start + completed_items - progress_bar.n)
+                if progress_callback:
+                    progress_callback(start + completed_items)
+
+            enriched_shard = await enrich_conversations_with_summaries_and_tags_async(
+                conversations_df=conversations_df.iloc[start : start + shard_size],
+                show_progress=False,
+                progress_callback=shard_progress_callback,
+                openai_client=openai_client,
+                rate_limit_budget=rate_limit_budget,
+                **enrichment_kwargs,
+            )
+            enriched_shards.append(enriched_shard)
+            follow_up_tasks.append(
+                asyncio.create_task(process_enriched_shard(enriched_shard))
+            )
 
+        follow_up_results = await asyncio.gather(*follow_up_tasks)
+    except BaseException:
+        for task in follow_up_tasks:
+            task.cancel()
+        raise
+    finally:
+        progress_bar.close()
 
-def label_conversation_clusters(
+    if not enriched_shards:
+        return conversations_df.assign(summary=None, tags=None), []
+    return pd.concat(enriched_shards), list(follow_up_results)
+
+
+async def label_conversation_clusters_async(
     conversations_df: pd.DataFrame,
     cluster_metrics_df: pd.DataFrame,
     gpt_model: str = settings.DEFAULT_GPT_MODEL,
     max_parallel_requests: int = settings.MAX_CONCURRENT_OPENAI_REQUESTS,
     show_progress: bool = True,
     progress_callback: Optional[Callable[[int], None]] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
+    rate_limit_budget: Optional[openai_utils._RateLimitBudget] = None,
 ) -> pd.DataFrame:
     """
     Labels conversation clusters using GPT to analyze centroid conversations and tag counts.
@@ -149,25 +374,23 @@ def label_conversation_clusters(
         max_parallel_requests (int): Maximum number of parallel requests to make to OpenAI
         show_progress (bool): Whether to show progress bar
         progress_callback (Optional[Callable[[int], None]]): Optional callback function to report progress
+        openai_client (Optional[AsyncOpenAI]): A client to share with other requests (see
+            openai_utils.create_async_openai_client). If it's not provided, one is created for this call.
+        rate_limit_budget (Optional[openai_utils._RateLimitBudget]): A rate limit budget to share with
+            other requests (see openai_utils.open_openai_session). If it's not provided, one is created
+            for this call.
 
     Returns:
         pd.DataFrame: Copy of clusters_df with additional columns:
             cluster_label, cluster_description
     """
 
-    # Define system prompt for cluster labeling
-    system_prompt = """
-    You're an intelligent AI assistant who likes responding in JSON.
-
-    The user will provide you with a list of conversation summaries from a cluster of related conversations.
-    Your task is to analyze these summaries and identify the common themes and topics that unite them.
-
-    You'll provide:
-    1. A brief, descriptive title for the cluster that captures its main theme
-    2. A 1-2 sentence description explaining what types of conversations are in this cluster and what unites them
-
-    Please ensure your response is concise but informative, focusing on the key patterns that emerge from the conversation cluster.
-    """
+    # Define system prompt for cluster labeling (kept short, as the response schema describes each field)
+    system_prompt = (
+        "Given summaries of a cluster of related conversations and its tag counts, identify the "
+        "themes that unite them: give the cluster a brief, descriptive title and a 1-2 sentence "
+        "description of what types of conversations it holds."
+    )
 
     # Define a "ConversationClusterSummary" Pydantic model that will be used to validate the AI's response
     class ConversationClusterSummary(BaseModel):
@@ -181,31 +404,52 @@ def label_conversation_clusters(
     # Create working copy of clusters DataFrame
     labeled_clusters_df = cluster_metrics_df.copy()
 
-    # Create centroid summaries markdown
-    labeled_clusters_df["centroid_summaries"] = labeled_clusters_df[
-        "centroid_conversation_ids"
-    ].apply(
-        lambda ids: [
-            f"**{title}**\n\n{summary}"
-            for title, summary in conversations_df[
-                conversations_df["conversation_id"].isin(ids)
-            ][["title", "summary"]].values.tolist()
-        ]
+    # Create centroid summaries markdown for every cluster at once: explode the clusters into one
+    # row per centroid conversation, join in those conversations' titles and summaries, and then
+    # collect each cluster's summaries back into a list (keeping their centroid order)
+    centroid_conversations_df = (
+        labeled_clusters_df[["cluster", "centroid_conversation_ids"]]
+        .explode("centroid_conversation_ids")
+        .rename(columns={"centroid_conversation_ids": "conversation_id"})
+        .merge(
+            conversations_df[["conversation_id", "title", "summary"]],
+            on="conversation_id",
+        )
+    )
+    # (Conversations whose enrichment failed have no summary; they're shown as "None", as before)
+    centroid_conversations_df["summary_markdown"] = (
+        "**"
+        + centroid_conversations_df["title"].fillna("None").astype(str)
+        + "**\n\n"
+        + centroid_conversations_df["summary"].fillna("None").astype(str)
+    )
+    centroid_summaries = centroid_conversations_df.groupby("cluster", sort=False)[
+        "summary_markdown"
+    ].agg(list)
+    labeled_clusters_df["centroid_summaries"] = labeled_clusters_df["cluster"].map(
+        centroid_summaries
     )
 
     # Format summaries into markdown
-    labeled_clusters_df["centroid_summary_markdown"] = labeled_clusters_df[
-        "centroid_summaries"
-    ].apply(lambda x: "---\n\n" + "\n\n---\n\n".join(x) + "\n\n---\n\n")
+    labeled_clusters_df["centroid_summary_markdown"] = (
+        "---\n\n"
+        + labeled_clusters_df["centroid_summaries"].str.join("\n\n---\n\n")
+        + "\n\n---\n\n"
+    )
 
     # Create final prompt markdown combining summaries and tag counts
-    labeled_clusters_df["prompt_markdown"] = labeled_clusters_df.apply(
-        lambda row: f"# **Example Conversations:**\n\n{row['centroid_summary_markdown']}\n\n# **Tag Counts:**\n\n```json\n{json.dumps(row['tag_counts'], indent=4)}\n```",
-        axis=1,
+    labeled_clusters_df["prompt_markdown"] = (
+        "# **Example Conversations:**\n\n"
+        + labeled_clusters_df["centroid_summary_markdown"]
+        + "\n\n# **Tag Counts:**\n\n```json\n"
+        + labeled_clusters_df["tag_counts"].map(
+            lambda tag_counts: orjson.dumps(tag_counts).decode()
+        )
+        + "\n```"
     )
 
     # Generate cluster labels using GPT
-    completions = openai_utils.generate_completions_in_parallel(
+    completions = await openai_utils.generate_completions_in_parallel_async(
         message_format_pairs=[
             (
                 [
@@ -218,20 +462,22 @@ def label_conversation_clusters(
                         "content": [
                             {
                                 "type": "text",
-                                "text": row.prompt_markdown,
+                                "text": prompt_markdown,
                             }
                         ],
                     },
                 ],
                 ConversationClusterSummary,
             )
-            for row in labeled_clusters_df.itertuples()
+            for prompt_markdown in labeled_clusters_df["prompt_markdown"].tolist()
         ],
         gpt_model=gpt_model,
         max_parallel_requests=max_parallel_requests,
         show_progress=show_progress,
         tqdm_label="Labeling conversation clusters",
         progress_callback=progress_callback,
+        openai_client=openai_client,
+        rate_limit_budget=rate_limit_budget,
     )
 
     # Parse completions
@@ -246,12 +492,12 @@ def label_conversation_clusters(
 
     # Add summaries to DataFrame
     labeled_clusters_df["cluster_summary"] = cluster_summaries
-    labeled_clusters_df["cluster_label"] = labeled_clusters_df["cluster_summary"].apply(
-        lambda x: x.title if x else None
-    )
-    labeled_clusters_df["cluster_description"] = labeled_clusters_df[
-        "cluster_summary"
-    ].apply(lambda x: x.description if x else None)
+    labeled_clusters_df["cluster_label"] = [
+        x.title if x else None for x in cluster_summaries
+    ]
+    labeled_clusters_df["cluster_description"] = [
+        x.description if x else None for x in cluster_summaries
+    ]
 
     # Clean up intermediate columns
     labeled_clusters_df = labeled_clusters_df.drop(
@@ -264,3 +510,32 @@ def label_conversation_clusters(
     )
 
     return labeled_clusters_df
+
+
+def label_conversation_clusters(
+    conversations_df: pd.DataFrame,
+    cluster_metrics_df: pd.DataFrame,
+    gpt_model: str = settings.DEFAULT_GPT_MODEL,
+    max_parallel_requests: int = settings.MAX_CONCURRENT_OPENAI_REQUESTS,
+    show_progress: bool = True,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> pd.DataFrame:
+    """
+    Synchronous wrapper around `label_conversation_clusters_async` (see it for the arguments). If
+    it's called from a thread that's already running an event loop (e.g. a Jupyter notebook), the
+    coroutine is run on a separate thread instead.
+
+    Returns:
+        pd.DataFrame: Copy of clusters_df with additional columns:
+            cluster_label, cluster_description
+    """
+    return openai_utils._run_coroutine_sync(
+        label_conversation_clusters_async(
+            conversations_df=conversations_df,
+            cluster_metrics_df=cluster_metrics_df,
+            gpt_model=gpt_model,
+            max_parallel_requests=max_parallel_requests,
+            show_progress=show_progress,
+            progress_callback=progress_callback,
+        )
+    )
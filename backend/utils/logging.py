@@ -8,7 +8,10 @@ This module configures logging for the ChatGPT Explorer.
 # Below, we'll set up the logging configuration.
 
 # General imports
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 
 
@@ -20,6 +23,13 @@ import sys
 
 def configure_logging():
     """Configure root logger with console handler and formatting"""
+    # Skip gathering the record attributes our format never uses (most notably the caller's
+    # source location, which walks the stack on every call), as the logging docs suggest
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
     # Create root logger
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
@@ -34,8 +44,15 @@ def configure_logging():
     )
     console_handler.setFormatter(formatter)
 
-    # Add console handler to root logger
-    root_logger.addHandler(console_handler)
+    # Add console handler to root logger, behind a queue; the calling thread only enqueues the
+    # record, and a background listener thread does the formatting and the (blocking) writes
+    log_queue = queue.SimpleQueue()
+    queue_listener = logging.handlers.QueueListener(
+        log_queue, console_handler, respect_handler_level=True
+    )
+    queue_listener.start()
+    atexit.register(queue_listener.stop)  # Flushes any records still in the queue
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
     # Suppress httpx logging
     logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -8,20 +8,24 @@ This module contains various utility functions related to the OpenAI APIs.
 # The code below will help to set up the rest of this utility file.
 
 # General import statements
+import asyncio
 import json
 import time
 import random
-from typing import List, Optional, Tuple, Union, Callable
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Iterable, List, Optional, Tuple, Union, Callable
 from concurrent.futures import ThreadPoolExecutor
 
 # Third-party import statements
+import httpx
 import openai
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_fixed
 from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 from tqdm import tqdm
 import numpy as np
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
 # ==================
 # DEFINING CONSTANTS
@@ -43,77 +47,242 @@ OPENAI_MODEL_RATE_LIMITS = {
     "gpt-4o": {"tokens_per_minute": 800_000, "requests_per_minute": 5_000},
 }
 
+# The number of times a completion request is attempted before a rate limit error is raised
+MAX_RATE_LIMITED_ATTEMPTS = 5
+
+# The size of each client's connection pool, and how long idle connections are kept alive for
+OPENAI_MAX_CONNECTIONS = 64
+OPENAI_KEEPALIVE_EXPIRY_S = 75
+
 # ================
 # DEFINING METHODS
 # ================
 # Now, I'll define some utility methods that will help to interact with the OpenAI API.
 
 
-def _calculate_sleep_time(
-    tokens: Optional[int], model: str, n_workers: int, multiplier: float = 1.35
-) -> float:
+class _RateLimitBudget:
+    """
+    Paces completion requests to stay within a model's requests-per-minute and tokens-per-minute
+    limits, following the approach of OpenAI's cookbook `api_request_parallel_processor` script.
+    Both budgets are token buckets that refill continuously (up to one minute's worth of capacity),
+    and a request is only admitted once both have room for it. The number of requests in flight
+    also floats between 1 and `max_concurrency`: it's halved whenever a request is rate limited,
+    and creeps back up as requests succeed (additive increase / multiplicative decrease).
+    This is meant to be shared by the coroutines of a single event loop, including across calls
+    (e.g. by every shard of an enrichment), so the buckets and the learned concurrency carry over
+    from one call's requests to the next.
     """
-    Calculates the sleep time based on the number of tokens used in a completion.
 
-    Args:
-        tokens (int): The number of tokens used in the completion.
-        model (str): The model used for the completion.
-        n_workers (int): The number of workers submitting completions.
-        multiplier (float): A multiplier to adjust the sleep time. Defaults to 1.05.
+    def __init__(self, model: str, max_concurrency: int):
+        rate_limit_dict = OPENAI_MODEL_RATE_LIMITS.get(
+            model, OPENAI_MODEL_RATE_LIMITS["gpt-4o"]
+        )
+        self.max_requests_per_minute = rate_limit_dict["requests_per_minute"]
+        self.max_tokens_per_minute = rate_limit_dict["tokens_per_minute"]
+        self.available_request_capacity = float(self.max_requests_per_minute)
+        self.available_token_capacity = float(self.max_tokens_per_minute)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.concurrency_limit = float(self.max_concurrency)
+        self.n_in_flight = 0
+        self._last_refill = time.monotonic()
+        self._condition = asyncio.Condition()
+
+    def _refill(self):
+        # Refill both buckets in proportion to the time elapsed since the last refill
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        self.available_request_capacity = min(
+            self.available_request_capacity
+            + elapsed_minutes * self.max_requests_per_minute,
+            self.max_requests_per_minute,
+        )
+        self.available_token_capacity = min(
+            self.available_token_capacity
+            + elapsed_minutes * self.max_tokens_per_minute,
+            self.max_tokens_per_minute,
+        )
 
-    Returns:
-        sleep_time (float): The time to sleep in seconds.
+    async def acquire(self, n_tokens: int):
+        """Wait until a request costing (an estimated) `n_tokens` tokens can be sent"""
+        n_tokens = min(n_tokens, self.max_tokens_per_minute)
+        async with self._condition:
+            while True:
+                self._refill()
+                if (
+                    self.n_in_flight < int(self.concurrency_limit)
+                    and self.available_request_capacity >= 1
+                    and self.available_token_capacity >= n_tokens
+                ):
+                    break
+
+                # Wait until a request finishes, or until enough capacity has refilled
+                missing_requests = max(1 - self.available_request_capacity, 0)
+                missing_tokens = max(n_tokens - self.available_token_capacity, 0)
+                refill_wait_s = 60 * max(
+                    missing_requests / self.max_requests_per_minute,
+                    missing_tokens / self.max_tokens_per_minute,
+                )
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait(), timeout=max(refill_wait_s, 0.01)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+            self.available_request_capacity -= 1
+            self.available_token_capacity -= n_tokens
+            self.n_in_flight += 1
+
+    async def release(
+        self, reserved_tokens: int, used_tokens: Optional[int], rate_limited: bool
+    ):
+        """
+        Mark a request as finished. The tokens it reserved are reconciled with the tokens it
+        actually used; a rate-limited request gets all of them back (it's retried later).
+        """
+        async with self._condition:
+            self.n_in_flight -= 1
+            if rate_limited:
+                self.available_request_capacity += 1
+                self.available_token_capacity += reserved_tokens
+                self.concurrency_limit = max(self.concurrency_limit / 2, 1)
+            else:
+                if used_tokens is not None:
+                    self.available_token_capacity += reserved_tokens - used_tokens
+                self.concurrency_limit = min(
+                    self.concurrency_limit + 1 / self.concurrency_limit,
+                    self.max_concurrency,
+                )
+            self._condition.notify_all()
+
+
+def create_async_openai_client() -> AsyncOpenAI:
     """
-    if tokens is None:
-        return 0
-
-    # Sleep a small amount of time to avoid sending requests all at once
-    time.sleep(random.uniform(0, 0.35))
-
-    # Get the rate limits for the model
-    rate_limit_dict = OPENAI_MODEL_RATE_LIMITS.get(model)
-    if rate_limit_dict is None:
-        rate_limit_dict = OPENAI_MODEL_RATE_LIMITS.get("gpt-4o")
-
-    # Slightly modifiy the multiplier
-    multiplier += random.uniform(-0.1, 0.1)
-
-    # Calculate the sleep time
-    token_per_minute_sleep_time = (
-        (tokens / rate_limit_dict.get("tokens_per_minute"))
-        * multiplier
-        * n_workers
-        * 60
-    )
-    requests_per_minute_sleep_time = (
-        (1 / rate_limit_dict.get("requests_per_minute")) * multiplier * n_workers * 60
+    Creates an AsyncOpenAI client whose (httpx) connection pool is sized for this module's
+    parallel requests, so concurrent requests reuse kept-alive connections instead of each
+    paying for a new TCP / TLS handshake. The client should be shared by all of the requests
+    of a fan-out, and closed afterwards (e.g. with `async with`).
+    """
+    return AsyncOpenAI(
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_S,
+            )
+        )
     )
-    total_sleep_time = token_per_minute_sleep_time + requests_per_minute_sleep_time
 
-    # Return the total sleep time
-    return total_sleep_time
+
+@asynccontextmanager
+async def _borrow_openai_client(openai_client: Optional[AsyncOpenAI] = None):
+    """
+    Use the caller's client if one was passed (leaving it open for the caller's other requests),
+    and otherwise create one for the duration of the block
+    """
+    if openai_client is not None:
+        yield openai_client
+        return
+
+    async with create_async_openai_client() as openai_client:
+        yield openai_client
+
+
+def _run_coroutine_sync(coroutine):
+    """
+    Run a coroutine to completion from synchronous code. If it's called from a thread that's
+    already running an event loop (e.g. a Jupyter notebook), the coroutine is run on a separate
+    thread instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+@contextmanager
+def open_openai_session(gpt_model: str = "gpt-4o", max_parallel_requests: int = 16):
+    """
+    Opens a client (see create_async_openai_client) and a rate limit budget for synchronous code
+    that makes several rounds of requests, with other work in between, so that every round reuses
+    the same connection pool and is paced by the same budget. The client is bound to the event
+    loop that it's used on, so all of the rounds are run on one private event loop in a background
+    thread (which also works if the caller is already running a loop, e.g. in a Jupyter notebook).
+
+    Args:
+        gpt_model (str): The GPT model whose rate limits the budget follows. Defaults to "gpt-4o"
+        max_parallel_requests (int): Maximum number of parallel completion requests. Defaults to 16
+
+    Yields:
+        Tuple[AsyncOpenAI, _RateLimitBudget, Callable]: The client, the budget for completion
+            requests to `gpt_model`, and a function that runs a coroutine to completion on the
+            session's event loop and returns its result
+    """
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+
+    def run_coroutine(coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    try:
+        openai_client = create_async_openai_client()
+        rate_limit_budget = _RateLimitBudget(
+            model=gpt_model, max_concurrency=max_parallel_requests
+        )
+        try:
+            yield openai_client, rate_limit_budget, run_coroutine
+        finally:
+            run_coroutine(openai_client.close())
+            run_coroutine(loop.shutdown_asyncgens())
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+
+def _estimate_completion_tokens(messages: List[dict], max_tokens: int) -> int:
+    """
+    Estimates the number of tokens a completion will use before it's sent: roughly 4 characters
+    per prompt token, plus the maximum number of completion tokens (the estimate is reconciled
+    with the actual usage once the completion is back).
+    """
+    n_prompt_chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            n_prompt_chars += len(content)
+        else:
+            n_prompt_chars += sum(len(part.get("text", "")) for part in content or [])
+    return n_prompt_chars // 4 + max_tokens
 
 
 @retry(
     wait=wait_fixed(3),
     stop=stop_after_attempt(2),
+    retry=retry_if_not_exception_type(openai.RateLimitError),
     reraise=True,
 )
-def _generate_completion_with_backoff(
+async def _generate_completion_with_backoff(
+    openai_client: AsyncOpenAI,
     messages: List[dict],
     gpt_model: str,
-    n_workers: int,
     temperature: float = 0,
     max_tokens: int = 2_048,
     response_format: BaseModel = None,
 ) -> ChatCompletion:
     """
-    Generates a completion with a backoff strategy in case of failure / rate limiting.
+    Generates a completion, retrying once in case of failure. Rate limit errors aren't retried
+    here, since they're handled by the caller's _RateLimitBudget.
 
     Args:
+        openai_client (AsyncOpenAI): The client to send the request with.
         messages (List[dict]): The messages to use for the completion.
         gpt_model (str): The GPT model to use for the completion.
-        n_workers (int): The number of workers submitting completions.
         temperature (float): The sampling temperature for the completion. Defaults to 0.
         max_tokens (int): The maximum number of tokens to generate. Defaults to 2_048.
 
@@ -122,7 +291,7 @@ def _generate_completion_with_backoff(
     """
 
     # Submit the completion request
-    completion = openai.beta.chat.completions.parse(
+    completion = await openai_client.beta.chat.completions.parse(
         model=gpt_model,
         messages=messages,
         temperature=temperature,
@@ -130,14 +299,6 @@ def _generate_completion_with_backoff(
         response_format=response_format,
     )
 
-    # Determine the necessary sleep time
-    sleep_time = _calculate_sleep_time(
-        tokens=completion.usage.total_tokens, model=gpt_model, n_workers=n_workers
-    )
-
-    # Sleep for the necessary time
-    time.sleep(min(sleep_time, 3))
-
     # Return the completion
     return completion
 
@@ -174,27 +335,36 @@ def _calculate_completion_cost(
     return input_token_cost + output_token_cost
 
 
-def generate_embeddings_for_texts(
-    text_list: List[str],
+async def generate_embeddings_for_texts_async(
+    text_list: Iterable[str],
     model_name: str = "text-embedding-3-small",
     embedding_n_dimensions: Optional[int] = None,
     max_parallel_requests: int = 16,
     max_tokens_per_batch: int = 8_191,
+    max_texts_per_batch: int = 2_048,
     show_progress: bool = True,
     progress_callback: Optional[Callable[[int], None]] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
 ) -> np.ndarray:
     """
-    This function generates embeddings for a list of texts using an OpenAI embedding model.
+    This function generates embeddings for a list of texts using an OpenAI embedding model. The
+    batches are sent concurrently on a single event loop, with at most `max_parallel_requests`
+    requests in flight at once.
 
     Args:
-        text_list (List[str]): A list of texts for which embeddings are to be generated.
+        text_list (Iterable[str]): The texts for which embeddings are to be generated. This can be a
+            generator; it's consumed lazily, as batches are dispatched.
         model_name (str): The name of the OpenAI model to use for generating embeddings.
         embedding_n_dimensions (Optional[int]): The number of dimensions for the embeddings.
         max_parallel_requests (int): The maximum number of parallel requests to make to the OpenAI API.
         max_tokens_per_batch (int): The maximum number of tokens per batch.
+        max_texts_per_batch (int): The maximum number of texts per batch. The embeddings endpoint
+            accepts at most 2,048 inputs per request.
         show_progress (bool): Whether to show a progress bar.
         progress_callback (Optional[Callable[[int], None]]): Optional callback function to report progress.
             Callback function should accept an integer representing completed items.
+        openai_client (Optional[AsyncOpenAI]): A client to share with other requests (see
+            create_async_openai_client). If it's not provided, one is created for this call.
 
     Returns:
         np.ndarray: An array of embeddings for the texts.
@@ -211,59 +381,62 @@ def generate_embeddings_for_texts(
         )
         max_tokens_per_batch = 8_191
 
-    # Setting up the OpenAI client
-    openai_client = OpenAI()
+    # The same goes for the number of inputs in a single request
+    max_texts_per_batch = min(max_texts_per_batch, 2_048)
 
     # -------------
     # Batching Text
     # -------------
-    # First, I'll break the text into batches based on the max_tokens_per_batch
-
-    # Initialize the list of batches
-    batches = []
-
-    # Initialize the current batch
-    current_batch = []
-    cur_batch_token_ct = 0
-    for text in text_list:
-        # Estimate the number of tokens for the current text
-        n_tokens = len(text) / CHARS_PER_TOKEN
-
-        # If the current text would exceed the max_tokens_per_batch, then we'll start a new batch
-        if cur_batch_token_ct + n_tokens > max_tokens_per_batch:
-            batches.append(current_batch)
-            current_batch = []
-            cur_batch_token_ct = 0
-
-        # Add the current text to the current batch
-        current_batch.append(text)
-
-        # Update the current batch token count
-        cur_batch_token_ct += n_tokens
-
-    # Add the last batch if it's not empty
-    if current_batch:
-        batches.append(current_batch)
+    # First, I'll break the text into batches based on the max_tokens_per_batch. The batches are
+    # built lazily, so (when text_list is a generator) only the batches currently being embedded
+    # have their texts in memory
+
+    def _iter_batches():
+        # Initialize the current batch
+        current_batch = []
+        cur_batch_token_ct = 0
+        for text in text_list:
+            # Estimate the number of tokens for the current text
+            n_tokens = len(text) / CHARS_PER_TOKEN
+
+            # If the current text would exceed either batch limit, then we'll start a new batch
+            if current_batch and (
+                cur_batch_token_ct + n_tokens > max_tokens_per_batch
+                or len(current_batch) >= max_texts_per_batch
+            ):
+                yield current_batch
+                current_batch = []
+                cur_batch_token_ct = 0
+
+            # Add the current text to the current batch
+            current_batch.append(text)
+
+            # Update the current batch token count
+            cur_batch_token_ct += n_tokens
+
+        # Yield the last batch if it's not empty
+        if current_batch:
+            yield current_batch
 
     # --------------
     # Embedding Text
     # --------------
-    # Now that I've got all of the text in batches, I'll embed each batch
+    # Now, I'll embed the batches concurrently as they're built
 
     @retry(
         wait=wait_fixed(3),
         stop=stop_after_attempt(2),
         reraise=True,
     )
-    def _emb_helper(text_list: List[str], openai_client: OpenAI):
+    async def _emb_helper(text_list: List[str], openai_client: AsyncOpenAI):
         # Generate the embeddings for the current batch
 
         if embedding_n_dimensions is not None:
-            response = openai_client.embeddings.create(
+            response = await openai_client.embeddings.create(
                 input=text_list, model=model_name, dimensions=embedding_n_dimensions
             )
         else:
-            response = openai_client.embeddings.create(
+            response = await openai_client.embeddings.create(
                 input=text_list, model=model_name
             )
 
@@ -272,43 +445,106 @@ def generate_embeddings_for_texts(
 
         return embeddings
 
-    # Parallelize calls to the OpenAI API
-    futures = {}
-    results = {}
-    with ThreadPoolExecutor(max_workers=max_parallel_requests) as executor:
-
-        # Submit the futures
-        for i, batch in enumerate(batches):
-            futures[i] = executor.submit(_emb_helper, batch, openai_client)
-
-        # Collect the results
-        for i, future in tqdm(
-            iterable=futures.items(),
-            total=len(futures),
-            desc="Generating Embeddings",
-            disable=not show_progress,
-        ):
-            res = future.result()
-
-            if res is not None:
-                results[i] = res
-                if progress_callback:
-                    progress_callback(i + 1)
-            else:
-                raise ValueError("An error occurred while generating embeddings.")
+    # All of the batch coroutines run on the same event loop, so this counter and the
+    # progress bar can be updated without any locking
+    semaphore = asyncio.Semaphore(max_parallel_requests)
+    completed_items = 0
+    progress_bar = tqdm(
+        total=len(text_list) if hasattr(text_list, "__len__") else None,
+        desc="Generating Embeddings",
+        disable=not show_progress,
+    )
+
+    async def _embed_batch(batch: List[str], openai_client: AsyncOpenAI):
+        nonlocal completed_items
+
+        # The semaphore was acquired when this batch was dispatched
+        try:
+            res = await _emb_helper(batch, openai_client)
+        finally:
+            semaphore.release()
+
+        if res is None:
+            raise ValueError("An error occurred while generating embeddings.")
+
+        completed_items += len(batch)
+        progress_bar.update(len(batch))
+        if progress_callback:
+            progress_callback(completed_items)
+
+        return res
+
+    # Parallelize calls to the OpenAI API. A batch is only built (and dispatched) once one of the
+    # `max_parallel_requests` slots frees up; gather() returns the results in batch order
+    tasks = []
+    try:
+        async with _borrow_openai_client(openai_client) as openai_client:
+            for batch in _iter_batches():
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(_embed_batch(batch, openai_client)))
+            results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        progress_bar.close()
 
     # -----------------
     # Returning Results
     # -----------------
     # Finally, I can prepare and return the results of this function
 
-    # Concatenate the results into a single array, ensuring that the order of the original text_list is preserved
-    embeddings = np.concatenate([np.array(results[i]) for i in range(len(results))])
+    # Concatenate the results into a single contiguous float32 array, ensuring that the order of the original
+    # text_list is preserved
+    embeddings = np.concatenate([np.asarray(res, dtype=np.float32) for res in results])
 
     return embeddings
 
 
-def generate_completions_in_parallel(
+def generate_embeddings_for_texts(
+    text_list: Iterable[str],
+    model_name: str = "text-embedding-3-small",
+    embedding_n_dimensions: Optional[int] = None,
+    max_parallel_requests: int = 16,
+    max_tokens_per_batch: int = 8_191,
+    show_progress: bool = True,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> np.ndarray:
+    """
+    Synchronous wrapper around `generate_embeddings_for_texts_async`. If it's called from a
+    thread that's already running an event loop (e.g. a Jupyter notebook), the coroutine is
+    run on a separate thread instead.
+
+    Args:
+        text_list (Iterable[str]): The texts for which embeddings are to be generated. This can be a
+            generator; it's consumed lazily, as batches are dispatched.
+        model_name (str): The name of the OpenAI model to use for generating embeddings.
+        embedding_n_dimensions (Optional[int]): The number of dimensions for the embeddings.
+        max_parallel_requests (int): The maximum number of parallel requests to make to the OpenAI API.
+        max_tokens_per_batch (int): The maximum number of tokens per batch.
+        show_progress (bool): Whether to show a progress bar.
+        progress_callback (Optional[Callable[[int], None]]): Optional callback function to report progress.
+            Callback function should accept an integer representing completed items.
+
+    Returns:
+        np.ndarray: An array of embeddings for the texts.
+    """
+
+    coroutine = generate_embeddings_for_texts_async(
+        text_list=text_list,
+        model_name=model_name,
+        embedding_n_dimensions=embedding_n_dimensions,
+        max_parallel_requests=max_parallel_requests,
+        max_tokens_per_batch=max_tokens_per_batch,
+        show_progress=show_progress,
+        progress_callback=progress_callback,
+    )
+
+    return _run_coroutine_sync(coroutine)
+
+
+async def generate_completions_in_parallel_async(
     message_format_pairs: List[Tuple[List[dict], Optional[BaseModel]]],
     gpt_model: str = "gpt-4o",
     temperature: float = 0,
@@ -318,9 +554,13 @@ def generate_completions_in_parallel(
     tqdm_label: str = "Generating Completions",
     return_completion_costs: bool = False,
     progress_callback: Optional[Callable[[int], None]] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
+    rate_limit_budget: Optional[_RateLimitBudget] = None,
 ) -> Union[List[ChatCompletion], Tuple[List[ChatCompletion], float]]:
     """
-    Generates completions in parallel for multiple prompts using ThreadPoolExecutor.
+    Generates completions concurrently for multiple prompts on a single event loop, sharing one
+    client (and its connection pool) between all of the requests. The requests are paced to stay
+    within the model's rate limits (see _RateLimitBudget).
 
     Args:
         message_format_pairs (List[Tuple[List[dict], Optional[BaseModel]]]): List of tuples containing
@@ -334,6 +574,12 @@ def generate_completions_in_parallel(
         return_completion_costs (bool): Whether to return completion costs. Defaults to False
         progress_callback (Optional[Callable[[int], None]]): Optional callback function to report progress.
             Callback function should accept an integer representing completed items.
+        openai_client (Optional[AsyncOpenAI]): A client to share with other requests (see
+            create_async_openai_client). If it's not provided, one is created for this call.
+        rate_limit_budget (Optional[_RateLimitBudget]): A budget to share with other calls'
+            requests to the same model (see open_openai_session), so that they're all paced
+            together. If it's not provided, one is created for this call from `gpt_model` and
+            `max_parallel_requests`.
 
     Returns:
         Union[List[ChatCompletion], Tuple[List[ChatCompletion], float]]:
@@ -341,70 +587,158 @@ def generate_completions_in_parallel(
             If True, returns tuple of (completions list, total cost)
     """
 
-    def _completion_helper(
-        messages: List[dict], response_format: Optional[BaseModel]
-    ) -> ChatCompletion:
-        # Generate completion with backoff
-        completion = _generate_completion_with_backoff(
-            messages=messages,
-            gpt_model=gpt_model,
-            n_workers=max_parallel_requests,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            response_format=response_format,
+    # Requests are paced by a rate limit budget, rather than by sleeping after each one
+    if rate_limit_budget is None:
+        rate_limit_budget = _RateLimitBudget(
+            model=gpt_model, max_concurrency=max_parallel_requests
         )
 
-        # Calculate costs and sleep time
+    async def _completion_helper(
+        messages: List[dict],
+        response_format: Optional[BaseModel],
+        openai_client: AsyncOpenAI,
+    ) -> ChatCompletion:
+        estimated_tokens = _estimate_completion_tokens(messages, max_tokens)
+
+        for attempt in range(MAX_RATE_LIMITED_ATTEMPTS):
+            await rate_limit_budget.acquire(estimated_tokens)
+            try:
+                completion = await _generate_completion_with_backoff(
+                    openai_client=openai_client,
+                    messages=messages,
+                    gpt_model=gpt_model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    response_format=response_format,
+                )
+            except openai.RateLimitError:
+                await rate_limit_budget.release(
+                    estimated_tokens, used_tokens=None, rate_limited=True
+                )
+                if attempt == MAX_RATE_LIMITED_ATTEMPTS - 1:
+                    raise
+                # Back off a little before asking the budget for another slot
+                await asyncio.sleep(random.uniform(0.5, 1.5) * (attempt + 1))
+                continue
+            except BaseException:
+                await rate_limit_budget.release(
+                    estimated_tokens, used_tokens=None, rate_limited=False
+                )
+                raise
+            break
+
+        # Calculate costs, and reconcile the budget with the tokens that were actually used
         input_tokens = completion.usage.prompt_tokens
         output_tokens = completion.usage.completion_tokens
+        await rate_limit_budget.release(
+            estimated_tokens,
+            used_tokens=input_tokens + output_tokens,
+            rate_limited=False,
+        )
 
         cost = _calculate_completion_cost(
             model=gpt_model, input_tokens=input_tokens, output_tokens=output_tokens
         )
 
-        sleep_time = _calculate_sleep_time(
-            tokens=input_tokens + output_tokens,
-            model=gpt_model,
-            n_workers=max_parallel_requests,
+        return completion, cost
+
+    # All of the coroutines run on the same event loop, so this counter and the progress bar
+    # can be updated without any locking
+    completed_items = 0
+    progress_bar = tqdm(
+        total=len(message_format_pairs), desc=tqdm_label, disable=not show_progress
+    )
+
+    async def _track_completion(
+        messages: List[dict],
+        response_format: Optional[BaseModel],
+        openai_client: AsyncOpenAI,
+    ):
+        nonlocal completed_items
+
+        completion, cost = await _completion_helper(
+            messages, response_format, openai_client
         )
+        if completion is None:
+            raise ValueError("An error occurred while generating completion.")
 
-        time.sleep(sleep_time)
+        completed_items += 1
+        progress_bar.update(1)
+        if progress_callback:
+            progress_callback(completed_items)
 
         return completion, cost
 
-    # Parallelize calls to the OpenAI API
-    futures = {}
-    results = {}
-    completion_costs = {}
-    with ThreadPoolExecutor(max_workers=max_parallel_requests) as executor:
-        # Submit the futures
-        for i, (messages, response_format) in enumerate(message_format_pairs):
-            futures[i] = executor.submit(_completion_helper, messages, response_format)
-
-        completed_items = 0
-
-        # Collect the results
-        for i, future in tqdm(
-            iterable=futures.items(),
-            total=len(futures),
-            desc=tqdm_label,
-            disable=not show_progress,
-        ):
-            completion, cost = future.result()
-
-            if completion is not None:
-                results[i] = completion
-                completion_costs[i] = cost
-
-                completed_items += 1
-                if progress_callback:
-                    progress_callback(completed_items)
-            else:
-                raise ValueError("An error occurred while generating completion.")
+    # Parallelize calls to the OpenAI API; gather() returns the results in the original order
+    tasks = []
+    try:
+        async with _borrow_openai_client(openai_client) as openai_client:
+            tasks = [
+                asyncio.create_task(
+                    _track_completion(messages, response_format, openai_client)
+                )
+                for messages, response_format in message_format_pairs
+            ]
+            results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        progress_bar.close()
 
     # Return results in original order with optional costs
-    completions = [results[i] for i in range(len(results))]
+    completions = [completion for completion, _ in results]
     if return_completion_costs:
-        total_cost = sum(completion_costs.values())
+        total_cost = sum(cost for _, cost in results)
         return completions, total_cost
     return completions
+
+
+def generate_completions_in_parallel(
+    message_format_pairs: List[Tuple[List[dict], Optional[BaseModel]]],
+    gpt_model: str = "gpt-4o",
+    temperature: float = 0,
+    max_tokens: int = 2_048,
+    max_parallel_requests: int = 16,
+    show_progress: bool = True,
+    tqdm_label: str = "Generating Completions",
+    return_completion_costs: bool = False,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> Union[List[ChatCompletion], Tuple[List[ChatCompletion], float]]:
+    """
+    Synchronous wrapper around `generate_completions_in_parallel_async`. If it's called from a
+    thread that's already running an event loop (e.g. a Jupyter notebook), the coroutine is
+    run on a separate thread instead.
+
+    Args:
+        message_format_pairs (List[Tuple[List[dict], Optional[BaseModel]]]): List of tuples containing
+            (messages, response_format) pairs for each completion
+        gpt_model (str): The GPT model to use for completions. Defaults to "gpt-4o"
+        temperature (float): Temperature setting for completions. Defaults to 0
+        max_tokens (int): Maximum tokens per completion. Defaults to 2,048
+        max_parallel_requests (int): Maximum number of parallel requests. Defaults to 16
+        show_progress (bool): Whether to show progress bar. Defaults to True
+        tqdm_label (str): Label for the progress bar. Defaults to "Generating Completions"
+        return_completion_costs (bool): Whether to return completion costs. Defaults to False
+        progress_callback (Optional[Callable[[int], None]]): Optional callback function to report progress.
+            Callback function should accept an integer representing completed items.
+
+    Returns:
+        Union[List[ChatCompletion], Tuple[List[ChatCompletion], float]]:
+            If return_completion_costs is False, returns list of completion responses.
+            If True, returns tuple of (completions list, total cost)
+    """
+    return _run_coroutine_sync(
+        generate_completions_in_parallel_async(
+            message_format_pairs=message_format_pairs,
+            gpt_model=gpt_model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            max_parallel_requests=max_parallel_requests,
+            show_progress=show_progress,
+            tqdm_label=tqdm_label,
+            return_completion_costs=return_completion_costs,
+            progress_callback=progress_callback,
+        )
+    )
@@ -8,26 +8,42 @@ This module contains various utility functions related to preprocessing pipeline
 # Below, we'll set up the rest of the file.
 
 # General imports
-import json
+import hashlib
 import math
+import multiprocessing
+import os
 import sqlite3
 import warnings
+from contextlib import closing
 
 # Third-party imports
-import pandas as pd
 import numpy as np
+import orjson
 from tqdm import tqdm
-from umap import UMAP
 
-# Project imports
+# Project imports (the heavier ones - UMAP, pandas, scikit-learn and the OpenAI client - are
+# imported where they're used, so importing this module stays cheap)
 import utils.settings as settings
-import utils.data_parsing as data_utils
-import utils.llm_enrichment as llm_utils
-import utils.openai as openai_utils
-import utils.clusters as cluster_utils
 
-# Ignore warnings
-warnings.filterwarnings("ignore")
+# The embedding cache maps a hash of each embedded text to its embedding. It's kept across runs,
+# unlike the other tables (which are recreated every time)
+CREATE_EMBEDDING_CACHE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    key TEXT PRIMARY KEY,
+    emb BLOB,
+    dim INTEGER
+)
+"""
+
+# Embeddings are stored in the cache as float16, which halves their size; float16 keeps ~3
+# significant digits, which is plenty for the embedding vectors
+EMBEDDING_CACHE_DTYPE = np.float16
+
+# The number of conversations sent to an extraction process at a time
+EXTRACTION_CHUNK_SIZE = 32
+
+# The number of keys looked up in the embedding cache per query
+EMBEDDING_CACHE_LOOKUP_BATCH_SIZE = 500
 
 # ================
 # DEFINING METHODS
@@ -35,278 +51,474 @@ warnings.filterwarnings("ignore")
 # Next, we'll define the utility functions that we'll use to preprocess the data.
 
 
-def preprocess_conversation_data(
-    conversations: list[dict], db_path: str = "data/conversations.db"
-) -> None:
-    """
-    Preprocesses conversation data and stores it in a SQLite database.
+def _embedding_cache_key(text: str) -> str:
+    """Returns the embedding cache key of a text (a hash of the text and the embedding model)"""
+    return hashlib.blake2b(
+        f"{settings.DEFAULT_EMBEDDING_MODEL}\n{text}".encode(), digest_size=16
+    ).hexdigest()
 
-    Args:
-        conversations: List of conversation dictionaries from the conversations.json export
-        db_path: Path to SQLite database file to create/use
-    """
 
-    # Print that we're starting the preprocessing
-    print("Starting conversation data preprocessing...")
+def _load_cached_embeddings(db_path: str, keys: list[str]) -> dict[str, np.ndarray]:
+    """
+    Looks up embeddings in the embedding cache.
 
-    # ---------------------
-    # Initializing Database
-    # ---------------------
-    # We'll start by initializing the database and creating the necessary tables.
+    Args:
+        db_path: Path to the SQLite database file holding the cache
+        keys: The cache keys to look up (see _embedding_cache_key)
 
-    # Create database connection
-    db_conn = sqlite3.connect(db_path)
-    db_cursor = db_conn.cursor()
-
-    # Drop existing tables if they exist
-    db_cursor.execute("DROP TABLE IF EXISTS conversations")
-    db_cursor.execute("DROP TABLE IF EXISTS clusters")
-
-    # Create conversations table
-    create_conversations_table_query = """
-    CREATE TABLE conversations (
-        conversation_id TEXT PRIMARY_KEY,
-        title TEXT NOT NULL, 
-        create_time INTEGER,
-        default_model_slug TEXT,
-        raw_messages_data TEXT,
-        messages_markdown TEXT,
-        summary TEXT,
-        tags TEXT,
-        embedding BLOB,
-        umap_x REAL,
-        umap_y REAL
-    )
+    Returns:
+        A dictionary mapping each key that was found to its embedding
     """
-    db_cursor.execute(create_conversations_table_query)
-
-    # Create clusters table
-    create_clusters_table_query = """
-    CREATE TABLE clusters (
-        cluster_solution_id TEXT,
-        cluster_id TEXT,
-        conversation_ids TEXT,
-        centroid_conversation_ids TEXT,
-        centroid_embedding BLOB,
-        cluster_size INTEGER,
-        cluster_label TEXT,
-        cluster_description TEXT,
-        tag_counts TEXT,
-        mean_cosine_similarity REAL,
-        cluster_radius REAL,
-        silhouette_score REAL,
-        centroid_umap_x REAL,
-        centroid_umap_y REAL,
-        PRIMARY KEY (cluster_solution_id, cluster_id)
-    )
+    cached_embeddings = {}
+    with closing(sqlite3.connect(db_path)) as db_conn:
+        with db_conn:
+            db_conn.execute(CREATE_EMBEDDING_CACHE_TABLE_QUERY)
+        for start in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_BATCH_SIZE):
+            keys_batch = keys[start : start + EMBEDDING_CACHE_LOOKUP_BATCH_SIZE]
+            rows = db_conn.execute(
+                f"SELECT key, emb FROM embedding_cache WHERE key IN ({', '.join('?' * len(keys_batch))})",
+                keys_batch,
+            )
+            for key, emb in rows:
+                cached_embeddings[key] = np.frombuffer(
+                    emb, dtype=EMBEDDING_CACHE_DTYPE
+                ).astype(np.float32)
+    return cached_embeddings
+
+
+async def _embed_enriched_conversations(
+    enriched_conversations_df: "pd.DataFrame",
+    db_path: str,
+    openai_client: "AsyncOpenAI",
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
     """
-    db_cursor.execute(create_clusters_table_query)
+    Embeds enriched conversations. Each text's embedding is cached under a hash of the text (see
+    _embedding_cache_key), so re-running the pipeline only embeds the conversations whose text has
+    changed.
 
-    # ---------------------------------
-    # Loading Initial Conversation Data
-    # ---------------------------------
-    # Next, we'll process the conversations and prepare the initial data to insert into the database.
+    Args:
+        enriched_conversations_df: Conversations with their summaries and tags
+        db_path: Path to the SQLite database file holding the embedding cache
+        openai_client: The client to request the missing embeddings with
 
-    # Process conversations and prepare initial data
-    conversations_data_to_insert = []
-    for conversation in tqdm(conversations, desc="Processing conversations"):
-        messages_df = data_utils.extract_longest_conversation_df(
-            mapping=conversation.get("mapping", {})
+    Returns:
+        The (raw, float32) embedding of each conversation, and the embeddings that weren't
+        cached yet (keyed by their cache keys)
+    """
+    import utils.openai as openai_utils
+
+    # The texts are built with whole-column string operations, rather than formatting each
+    # row in Python
+    embedding_texts = (
+        enriched_conversations_df["title"].astype(str)
+        + "\nTags: "
+        + enriched_conversations_df["tags"].str.join(", ").fillna("")
+        + "\nSummary: "
+        + enriched_conversations_df["summary"].fillna("None").astype(str)
+        + "\nConversation: "
+        + enriched_conversations_df["messages_markdown"].str.slice(
+            0, settings.MAX_CHARS_PER_CONVERSATION_CONTEXT
         )
+    ).tolist()
+    embedding_cache_keys = [_embedding_cache_key(text) for text in embedding_texts]
+    cached_embeddings = _load_cached_embeddings(db_path, embedding_cache_keys)
+    uncached_indices = [
+        i for i, key in enumerate(embedding_cache_keys) if key not in cached_embeddings
+    ]
 
-        cur_conversation_data = {
-            "conversation_id": conversation.get("conversation_id"),
-            "title": conversation.get("title", "UNTITLED CONVERSATION"),
-            "create_time": conversation.get("create_time"),
-            "default_model_slug": conversation.get("default_model_slug"),
-            "raw_messages_data": messages_df.to_json(),
-            "messages_markdown": data_utils.extract_simple_conversation_markdown(
-                conversation_df=messages_df
-            ),
+    new_embeddings = {}
+    if uncached_indices:
+        uncached_embs = await openai_utils.generate_embeddings_for_texts_async(
+            text_list=(embedding_texts[i] for i in uncached_indices),
+            model_name=settings.DEFAULT_EMBEDDING_MODEL,
+            show_progress=False,
+            openai_client=openai_client,
+        )
+        new_embeddings = {
+            embedding_cache_keys[i]: emb
+            for i, emb in zip(uncached_indices, uncached_embs)
         }
-        conversations_data_to_insert.append(cur_conversation_data)
-
-    # Insert initial conversation data
-    insert_conversations_query = """
-    INSERT INTO conversations (
-        conversation_id,
-        title,
-        create_time,
-        default_model_slug,
-        raw_messages_data,
-        messages_markdown
-    ) VALUES (
-        :conversation_id,
-        :title,
-        :create_time,
-        :default_model_slug,
-        :raw_messages_data,
-        :messages_markdown
+    embs = np.stack(
+        [
+            cached_embeddings[key] if key in cached_embeddings else new_embeddings[key]
+            for key in embedding_cache_keys
+        ]
     )
+    return embs, new_embeddings
+
+
+def _extract_conversation_data(conversation: dict) -> dict:
     """
-    db_cursor.executemany(insert_conversations_query, conversations_data_to_insert)
-    db_conn.commit()
+    Extracts the initial data (before enrichment) of a conversation from the export. This is
+    defined at the module level so that it can be sent to the worker processes.
 
-    # ---------------------------
-    # Enriching Conversation Data
-    # ---------------------------
-    # Next, we'll enrich the conversation data with summaries, tags, embeddings, and UMAP projections.
+    Args:
+        conversation: A conversation dictionary from the conversations.json export
+
+    Returns:
+        A dictionary with the conversation's initial columns
+    """
+    import utils.data_parsing as data_utils
 
-    # Enrich conversations with LLM summaries and tags
-    llm_enriched_conversations_df = llm_utils.enrich_conversations_with_summaries_and_tags(
-        conversations_df=pd.DataFrame(conversations_data_to_insert),
-        max_chars_per_conversation_context=settings.MAX_CHARS_PER_CONVERSATION_CONTEXT,
+    messages = data_utils.extract_longest_conversation_messages(
+        mapping=conversation.get("mapping", {})
     )
 
-    # Update conversations with summaries and tags
-    conversations_data_to_insert = [
-        {
-            "conversation_id": row.conversation_id,
-            "summary": row.summary,
-            "tags": json.dumps(row.tags),
-        }
-        for row in llm_enriched_conversations_df.itertuples()
-    ]
+    return {
+        "conversation_id": conversation.get("conversation_id"),
+        "title": conversation.get("title", "UNTITLED CONVERSATION"),
+        "create_time": conversation.get("create_time"),
+        "default_model_slug": conversation.get("default_model_slug"),
+        # The messages are serialized straight from the list of dicts with orjson, rather
+        # than going through a DataFrame and pandas' (much slower) JSON encoder
+        "raw_messages_data": orjson.dumps(
+            messages, option=orjson.OPT_NON_STR_KEYS
+        ).decode(),
+        "messages_markdown": data_utils.extract_simple_conversation_markdown(
+            messages=messages
+        ),
+    }
 
-    db_cursor.executemany(
-        """
-        UPDATE conversations
-        SET summary = :summary, tags = :tags
-        WHERE conversation_id = :conversation_id
-        """,
-        conversations_data_to_insert,
-    )
-    db_conn.commit()
 
-    # Generate embeddings
-    embs = openai_utils.generate_embeddings_for_texts(
-        text_list=[
-            f"{row.title}\nTags: {', '.join(row.tags)}\nSummary: {row.summary}\nConversation: {row.messages_markdown[:settings.MAX_CHARS_PER_CONVERSATION_CONTEXT]}"
-            for row in llm_enriched_conversations_df.itertuples()
-        ]
-    )
+def preprocess_conversation_data(
+    conversations: list[dict], db_path: str = "data/conversations.db"
+) -> None:
+    """
+    Preprocesses conversation data and stores it in a SQLite database.
 
-    conversation_emb_df = llm_enriched_conversations_df.copy()[["conversation_id"]]
-    conversation_emb_df["embedding"] = embs.tolist()
+    Args:
+        conversations: List of conversation dictionaries from the conversations.json export
+        db_path: Path to SQLite database file to create/use
+    """
 
-    # Generate UMAP projections
-    umap_model = UMAP(n_components=2)
-    conversation_emb_df[["umap_x", "umap_y"]] = umap_model.fit_transform(
-        np.stack(conversation_emb_df.embedding)
-    )
+    from umap import UMAP
 
-    # Update conversations with embeddings and UMAP coordinates
-    conversations_data_to_insert = [
-        {
-            "conversation_id": row.conversation_id,
-            "embedding": np.array(row.embedding, dtype=np.float32).tobytes(),
-            "umap_x": row.umap_x,
-            "umap_y": row.umap_y,
-        }
-        for row in conversation_emb_df.itertuples()
-    ]
+    from database import DatabaseManager
+    import utils.clusters as cluster_utils
+    import utils.llm_enrichment as llm_utils
+    import utils.openai as openai_utils
 
-    db_cursor.executemany(
-        """
-        UPDATE conversations
-        SET embedding = :embedding, umap_x = :umap_x, umap_y = :umap_y
-        WHERE conversation_id = :conversation_id
-        """,
-        conversations_data_to_insert,
-    )
-    db_conn.commit()
+    # Print that we're starting the preprocessing
+    print("Starting conversation data preprocessing...")
 
-    # ------------------------
-    # Clustering Conversations
-    # ------------------------
-    # Finally, we'll cluster the conversations and insert the cluster data into the database.
+    # ---------------------------------
+    # Loading Initial Conversation Data
+    # ---------------------------------
+    # Next, we'll process the conversations and prepare their initial data. Nothing is written to the
+    # database until every stage is done; each conversation's row is then inserted once, complete.
+
+    # Process conversations and prepare initial data. This is CPU-bound work on independent
+    # conversations, so it's spread across a pool of processes (unless there's only one CPU,
+    # or too few conversations to be worth starting the pool for)
+    n_workers = os.cpu_count() or 1
+    if n_workers < 2 or len(conversations) <= EXTRACTION_CHUNK_SIZE:
+        conversations_data_to_insert = [
+            _extract_conversation_data(conversation)
+            for conversation in tqdm(conversations, desc="Processing conversations")
+        ]
+    else:
+        with multiprocessing.Pool(n_workers) as pool:
+            conversations_data_to_insert = list(
+                tqdm(
+                    pool.imap(
+                        _extract_conversation_data,
+                        conversations,
+                        chunksize=EXTRACTION_CHUNK_SIZE,
+                    ),
+                    total=len(conversations),
+                    desc="Processing conversations",
+                )
+            )
 
-    # Generate clusters
-    n_clusters = min(math.ceil(math.sqrt(len(conversation_emb_df))), 24)
+    # ---------------------------
+    # Enriching Conversation Data
+    # ---------------------------
+    # Next, we'll enrich the conversation data with summaries, tags, embeddings, and UMAP projections.
 
-    clusters_df = cluster_utils.cluster_conversations(
-        conversation_embs_df=conversation_emb_df.merge(
-            llm_enriched_conversations_df[["conversation_id", "tags"]],
-            on="conversation_id",
-        ),
-        n_clusters=n_clusters,
-    )
+    # One OpenAI client (and connection pool) is shared by the enrichment, embedding and labeling
+    # requests, which are run on the session's event loop; the completion requests are all paced
+    # by the session's rate limit budget
+    with openai_utils.open_openai_session(
+        gpt_model=settings.DEFAULT_GPT_MODEL,
+        max_parallel_requests=settings.MAX_CONCURRENT_OPENAI_REQUESTS,
+    ) as (openai_client, rate_limit_budget, run_openai_coroutine):
+        # Enrich conversations with LLM summaries and tags, and embed them. The conversations are
+        # enriched in shards, and each shard is embedded while the next one is being enriched; the
+        # records are passed as-is, so only the columns that the enrichment needs get loaded into a
+        # DataFrame
+        llm_enriched_conversations_df, embedded_shards = run_openai_coroutine(
+            llm_utils.enrich_conversations_in_shards_async(
+                conversations_df=conversations_data_to_insert,
+                process_enriched_shard=lambda enriched_shard_df: _embed_enriched_conversations(
+                    enriched_shard_df, db_path=db_path, openai_client=openai_client
+                ),
+                max_chars_per_conversation_context=settings.MAX_CHARS_PER_CONVERSATION_CONTEXT,
+                openai_client=openai_client,
+                rate_limit_budget=rate_limit_budget,
+            )
+        )
+        embs = np.concatenate([shard_embs for shard_embs, _ in embedded_shards])
+        new_embeddings = {
+            key: emb
+            for _, shard_new_embeddings in embedded_shards
+            for key, emb in shard_new_embeddings.items()
+        }
+        print(
+            f"Found {len(embs) - len(new_embeddings):,} of {len(embs):,} embeddings in the cache"
+        )
 
-    cluster_metrics_df = cluster_utils.calculate_cluster_metrics(clusters_df)
+        # Add the summaries and tags to the conversations' rows
+        for conversation_data, summary, tags in zip(
+            conversations_data_to_insert,
+            llm_enriched_conversations_df["summary"],
+            llm_enriched_conversations_df["tags"],
+        ):
+            conversation_data["summary"] = summary
+            conversation_data["tags"] = orjson.dumps(tags).decode()
+
+        # Keep the embeddings as a single contiguous float32 matrix, whose rows line up with the
+        # enriched conversations; everything downstream indexes into it by position
+        embs = np.ascontiguousarray(embs, dtype=np.float32)
+
+        # L2-normalize the embeddings once up front, so cosine similarities downstream are plain dot products
+        embs /= np.maximum(
+            np.linalg.norm(embs, axis=1, keepdims=True), np.finfo(np.float32).tiny
+        )
 
-    cluster_metrics_df[["umap_x", "umap_y"]] = umap_model.fit_transform(
-        np.stack(cluster_metrics_df.embedding_centroid)
-    )
+        # Generate UMAP projections
+        umap_model = UMAP(n_components=2, **settings.UMAP_CPU_KWARGS)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            umap_coords = umap_model.fit_transform(embs)
+
+        # Add the embeddings' row offsets (the matrix itself is saved in a sidecar file) and UMAP
+        # coordinates to the conversations' rows
+        for i, (conversation_data, (umap_x, umap_y)) in enumerate(
+            zip(conversations_data_to_insert, umap_coords.tolist())
+        ):
+            conversation_data["emb_row"] = i
+            conversation_data["umap_x"] = umap_x
+            conversation_data["umap_y"] = umap_y
+
+        # ------------------------
+        # Clustering Conversations
+        # ------------------------
+        # Next, we'll cluster the conversations and prepare the cluster data.
+
+        # Generate clusters
+        n_clusters = min(math.ceil(math.sqrt(len(embs))), 24)
+
+        cluster_ids = cluster_utils.cluster_embeddings(embs, n_clusters)
+
+        cluster_metrics_df = cluster_utils.calculate_cluster_metrics_from_arrays(
+            conversation_ids=llm_enriched_conversations_df[
+                "conversation_id"
+            ].to_numpy(),
+            embeddings=embs,
+            cluster_ids=cluster_ids,
+            conversation_tags=llm_enriched_conversations_df["tags"].tolist(),
+        )
 
-    # Label clusters using LLM
-    labeled_clusters_df = llm_utils.label_conversation_clusters(
-        conversations_df=llm_enriched_conversations_df,
-        cluster_metrics_df=cluster_metrics_df,
-    )
+        # Project the centroids with the already-fitted UMAP model, so they land in the same
+        # 2D space as the conversations they summarize (and we avoid a second fit)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            cluster_metrics_df[["umap_x", "umap_y"]] = umap_model.transform(
+                np.stack(cluster_metrics_df.embedding_centroid).astype(np.float32)
+            )
+
+        # Label clusters using LLM
+        labeled_clusters_df = run_openai_coroutine(
+            llm_utils.label_conversation_clusters_async(
+                conversations_df=llm_enriched_conversations_df,
+                cluster_metrics_df=cluster_metrics_df,
+                openai_client=openai_client,
+                rate_limit_budget=rate_limit_budget,
+            )
+        )
 
-    # Insert cluster data
+    # Prepare cluster data
+    centroid_embs = np.stack(labeled_clusters_df.embedding_centroid).astype(np.float32)
     clusters_data_to_insert = [
         {
             "cluster_solution_id": f"kmeans_{n_clusters}",
             "cluster_id": row.cluster,
-            "conversation_ids": json.dumps(row.all_conversation_ids),
-            "centroid_conversation_ids": json.dumps(row.centroid_conversation_ids),
-            "centroid_embedding": np.array(
-                row.embedding_centroid, dtype=np.float32
-            ).tobytes(),
+            "conversation_ids": orjson.dumps(row.all_conversation_ids).decode(),
+            "centroid_conversation_ids": orjson.dumps(
+                row.centroid_conversation_ids
+            ).decode(),
+            "centroid_row": i,
             "cluster_size": row.n_conversations,
             "cluster_label": row.cluster_label,
             "cluster_description": row.cluster_description,
-            "tag_counts": json.dumps(row.tag_counts),
+            "tag_counts": orjson.dumps(row.tag_counts).decode(),
             "mean_cosine_similarity": row.mean_cosine_similarity,
             "cluster_radius": row.cluster_radius,
             "silhouette_score": row.silhouette_score,
             "centroid_umap_x": row.umap_x,
             "centroid_umap_y": row.umap_y,
         }
-        for row in labeled_clusters_df.itertuples()
+        for i, row in enumerate(labeled_clusters_df.itertuples())
     ]
 
-    db_cursor.executemany(
-        """
-        INSERT INTO clusters (
-            cluster_solution_id,
-            cluster_id,
-            conversation_ids,
-            centroid_conversation_ids,
-            centroid_embedding,
-            cluster_size,
-            cluster_label,
-            cluster_description,
-            tag_counts,
-            mean_cosine_similarity,
-            cluster_radius,
-            silhouette_score,
-            centroid_umap_x,
-            centroid_umap_y
-        ) VALUES (
-            :cluster_solution_id,
-            :cluster_id,
-            :conversation_ids,
-            :centroid_conversation_ids,
-            :centroid_embedding,
-            :cluster_size,
-            :cluster_label,
-            :cluster_description,
-            :tag_counts,
-            :mean_cosine_similarity,
-            :cluster_radius,
-            :silhouette_score,
-            :centroid_umap_x,
-            :centroid_umap_y
-        )
-        """,
-        clusters_data_to_insert,
-    )
-    db_conn.commit()
-
-    # Close database connection
-    db_conn.close()
+    # -------------------
+    # Storing the Results
+    # -------------------
+    # Finally, we'll (re)create the tables and insert everything in a single transaction, so there's
+    # only one commit (and the previous data stays in place until the new data is complete). The
+    # embedding matrices are stored in the same (int8-quantized) .npy sidecar files that the API's
+    # DatabaseManager appends to, and only replaced once that transaction has committed.
+
+    # Create database connection; WAL mode with synchronous=NORMAL only syncs at checkpoints,
+    # rather than on every commit, and the larger page cache (negative values are in KiB) and
+    # in-memory temp store keep the bulk inserts (and their index builds) off the disk
+    db_conn = sqlite3.connect(db_path)
+    db_conn.execute("PRAGMA journal_mode=WAL")
+    db_conn.execute("PRAGMA synchronous=NORMAL")
+    db_conn.execute("PRAGMA cache_size=-65536")
+    db_conn.execute("PRAGMA temp_store=MEMORY")
+
+    try:
+        with db_conn:
+            # Python's sqlite3 doesn't open a transaction for DDL statements on its own
+            db_conn.execute("BEGIN")
+            db_cursor = db_conn.cursor()
+
+            # Drop existing tables if they exist
+            db_cursor.execute("DROP TABLE IF EXISTS conversations")
+            db_cursor.execute("DROP TABLE IF EXISTS clusters")
+
+            # Create conversations table
+            create_conversations_table_query = """
+            CREATE TABLE conversations (
+                conversation_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL, 
+                create_time INTEGER,
+                default_model_slug TEXT,
+                raw_messages_data TEXT,
+                messages_markdown TEXT,
+                summary TEXT,
+                tags TEXT,
+                emb_row INTEGER,
+                umap_x REAL,
+                umap_y REAL
+            )
+            """
+            db_cursor.execute(create_conversations_table_query)
+
+            # Create clusters table
+            create_clusters_table_query = """
+            CREATE TABLE clusters (
+                cluster_solution_id TEXT,
+                cluster_id TEXT,
+                conversation_ids TEXT,
+                centroid_conversation_ids TEXT,
+                centroid_row INTEGER,
+                cluster_size INTEGER,
+                cluster_label TEXT,
+                cluster_description TEXT,
+                tag_counts TEXT,
+                mean_cosine_similarity REAL,
+                cluster_radius REAL,
+                silhouette_score REAL,
+                centroid_umap_x REAL,
+                centroid_umap_y REAL,
+                PRIMARY KEY (cluster_solution_id, cluster_id)
+            )
+            """
+            db_cursor.execute(create_clusters_table_query)
+
+            # Insert conversation data
+            insert_conversations_query = """
+            INSERT INTO conversations (
+                conversation_id,
+                title,
+                create_time,
+                default_model_slug,
+                raw_messages_data,
+                messages_markdown,
+                summary,
+                tags,
+                emb_row,
+                umap_x,
+                umap_y
+            ) VALUES (
+                :conversation_id,
+                :title,
+                :create_time,
+                :default_model_slug,
+                :raw_messages_data,
+                :messages_markdown,
+                :summary,
+                :tags,
+                :emb_row,
+                :umap_x,
+                :umap_y
+            )
+            """
+            db_cursor.executemany(
+                insert_conversations_query, conversations_data_to_insert
+            )
+
+            # Cache the newly-generated embeddings
+            db_cursor.execute(CREATE_EMBEDDING_CACHE_TABLE_QUERY)
+            db_cursor.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, emb, dim) VALUES (?, ?, ?)",
+                [
+                    (
+                        key,
+                        memoryview(
+                            np.ascontiguousarray(emb, dtype=EMBEDDING_CACHE_DTYPE)
+                        ),
+                        len(emb),
+                    )
+                    for key, emb in new_embeddings.items()
+                ],
+            )
+
+            # Insert cluster data
+            db_cursor.executemany(
+                """
+                INSERT INTO clusters (
+                    cluster_solution_id,
+                    cluster_id,
+                    conversation_ids,
+                    centroid_conversation_ids,
+                    centroid_row,
+                    cluster_size,
+                    cluster_label,
+                    cluster_description,
+                    tag_counts,
+                    mean_cosine_similarity,
+                    cluster_radius,
+                    silhouette_score,
+                    centroid_umap_x,
+                    centroid_umap_y
+                ) VALUES (
+                    :cluster_solution_id,
+                    :cluster_id,
+                    :conversation_ids,
+                    :centroid_conversation_ids,
+                    :centroid_row,
+                    :cluster_size,
+                    :cluster_label,
+                    :cluster_description,
+                    :tag_counts,
+                    :mean_cosine_similarity,
+                    :cluster_radius,
+                    :silhouette_score,
+                    :centroid_umap_x,
+                    :centroid_umap_y
+                )
+                """,
+                clusters_data_to_insert,
+            )
+    finally:
+        # Close database connection
+        db_conn.close()
+
+    # Replace the embedding matrices, now that the rows pointing into them are committed
+    DatabaseManager(db_path).replace_embeddings(embs, centroid_embs)
 
     # Print that we're done with the preprocessing
     print("Conversation data preprocessing complete!")
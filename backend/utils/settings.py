@@ -9,4 +9,19 @@ This module contains various settings used across the API.
 
 MAX_CONCURRENT_OPENAI_REQUESTS = 32
 DEFAULT_GPT_MODEL = "gpt-4o-mini"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
 MAX_CHARS_PER_CONVERSATION_CONTEXT = 4_000
+
+# The number of conversations packed into each summary / tag enrichment request
+CONVERSATIONS_PER_ENRICHMENT_REQUEST = 5
+
+# The number of conversations enriched together before their embeddings are requested; each
+# shard's embeddings are generated while the next shard is being enriched
+ENRICHMENT_SHARD_SIZE = 500
+
+# Extra constructor arguments for umap-learn's (CPU) UMAP: use every core, keep the faster
+# (but more memory-hungry) nearest-neighbor search, and start from a PCA layout
+UMAP_CPU_KWARGS = {"n_jobs": -1, "low_memory": False, "init": "pca"}
+
+# Uploads up to this size are parsed in one shot; larger ones are spooled to disk and streamed
+MAX_IN_MEMORY_UPLOAD_BYTES = 16 * 1024 * 1024